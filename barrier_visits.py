@@ -0,0 +1,57 @@
+"""
+Barrier visits: one row per participant per visit to a ``NotifyingGroupBarrier``.
+
+Replaces the ``barrier_trace`` list in the trial vars, which every arrival and release
+rewrote in full. A visit is inserted on arrival and its release fields are updated in
+place; the (participant, barrier) index finds each participant's latest visit in one seek.
+"""
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, String, func
+
+from psynet.data import SQLBase, SQLMixin, register_table
+
+
+@register_table
+class BarrierVisit(SQLBase, SQLMixin):
+    """
+    A participant's visit to a barrier, stored against the trial they were on.
+
+    ``arrived`` and ``released`` are Unix timestamps; ``released`` is None while the
+    participant waits. ``on_release_ms`` is how long the barrier's ``on_release`` callback,
+    which holds the release until it finishes, took.
+    """
+
+    __tablename__ = "barrier_visit"
+    __table_args__ = (Index("ix_barrier_visit_participant_barrier", "participant_id", "barrier_id"),)
+
+    participant_id = Column(Integer, ForeignKey("participant.id"))
+    trial_id = Column(Integer, ForeignKey("info.id"))
+    barrier_id = Column(String)
+    arrived = Column(Float)
+    released = Column(Float)
+    on_release_ms = Column(Float)
+
+    @classmethod
+    def arrive(cls, participant, barrier_id, arrived):
+        from dallinger import db
+
+        trial = participant.current_trial
+        visit = cls(
+            participant_id=participant.id,
+            trial_id=trial.id if trial is not None else None,
+            barrier_id=barrier_id,
+            arrived=arrived,
+        )
+        db.session.add(visit)
+        return visit
+
+    @classmethod
+    def latest(cls, participant_ids, barrier_id):
+        """Map each participant ID to the participant's latest visit to the barrier, in one query."""
+        from dallinger import db
+
+        latest_ids = (
+            db.session.query(func.max(cls.id))
+            .filter(cls.participant_id.in_(participant_ids), cls.barrier_id == barrier_id)
+            .group_by(cls.participant_id)
+        )
+        return {visit.participant_id: visit for visit in cls.query.filter(cls.id.in_(latest_ids))}
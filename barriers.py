@@ -0,0 +1,266 @@
+import collections
+import json
+import os
+import socket
+import threading
+import time
+
+from psynet.sync import GroupBarrier
+from psynet.utils import call_function_with_context, get_logger
+
+from .barrier_visits import BarrierVisit
+from .roles import EPOCH_VAR
+
+logger = get_logger()
+
+# Barriers are released by psynet's check_barriers task in the clock process, and entered in
+# whichever web process served the participant, so processes share barrier events over redis
+EVENT_CHANNEL = "sigspace:barrier_events"
+LONG_POLL_SECONDS = 20  # how long one /wait request may be held open
+RECHECK_SECONDS = 1.0  # long polls look at the index (or database) at least this often
+EVENT_TTL_SECONDS = 60  # trust state learned from a barrier event this long while the listener is connected
+CACHE_TTL_SECONDS = 1.0  # and state read from the database, or learned without a listener, only this long
+RECONNECT_SECONDS = 5.0  # wait at least this long before restarting a listener that stopped
+
+
+class BarrierIndex:
+    """
+    In-memory map of which participants are waiting at a barrier.
+
+    Barrier events (entered, released) keep it current in every process; a lookup only falls
+    back to the database when the participant's entry is missing or has expired, and the
+    result is cached briefly. ``index_hits`` counts database queries avoided.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._entries = {}  # participant id -> (in_barrier, expires_at)
+        self._changes = collections.Counter()
+        self.index_hits = 0
+        self.db_hits = 0
+        self.events = 0
+
+    def apply(self, in_barrier, participant_ids, ttl=EVENT_TTL_SECONDS):
+        expires_at = time.monotonic() + ttl
+        with self._condition:
+            for participant_id in participant_ids:
+                self._entries[participant_id] = (in_barrier, expires_at)
+                self._changes[participant_id] += 1
+            self.events += 1
+            self._condition.notify_all()
+
+    def lookup(self, participant_id, load):
+        """Whether the participant is at a barrier; ``load()`` asks the database on a miss."""
+        barrier_events.ensure_listener()
+        participant_id = int(participant_id)
+        with self._condition:
+            entry = self._entries.get(participant_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self.index_hits += 1
+                return entry[0]
+            self.db_hits += 1
+            seen = self._changes[participant_id]
+        in_barrier = load()
+        with self._condition:
+            # an event that arrived while we were querying is newer than what we read
+            if self._changes[participant_id] == seen:
+                self._entries[participant_id] = (in_barrier, time.monotonic() + CACHE_TTL_SECONDS)
+        return in_barrier
+
+    def limit_ttl(self, ttl):
+        """Expire every entry within ``ttl`` seconds, e.g. once events may no longer arrive."""
+        latest = time.monotonic() + ttl
+        with self._condition:
+            for participant_id, (in_barrier, expires_at) in self._entries.items():
+                self._entries[participant_id] = (in_barrier, min(expires_at, latest))
+
+    def wait_until(self, participant_id, condition, timeout=LONG_POLL_SECONDS):
+        """
+        Block until ``condition()`` is true or ``timeout`` seconds pass; return whether it held.
+
+        ``condition`` is checked whenever an event changes the participant's entry, and
+        every ``RECHECK_SECONDS`` in case an event was missed.
+        """
+        participant_id = int(participant_id)
+        deadline = time.monotonic() + timeout
+        while True:
+            seen = self._changes[participant_id]
+            if condition():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            with self._condition:
+                self._condition.wait_for(lambda: self._changes[participant_id] != seen, min(RECHECK_SECONDS, remaining))
+
+    def stats(self):
+        lookups = self.index_hits + self.db_hits
+        return {
+            'participants': len(self._entries),
+            'events': self.events,
+            'index_hits': self.index_hits,
+            'db_hits': self.db_hits,
+            'db_hits_avoided_rate': self.index_hits / lookups if lookups else 0.0,
+        }
+
+
+barrier_index = BarrierIndex()
+
+
+class BarrierEvents:
+    """
+    Publishes barrier entries and releases to every process's ``barrier_index``.
+
+    Events are sent once the current transaction commits, so a process that hears about a
+    release and re-reads the database sees it. Other processes receive them over redis
+    pub/sub through a listener thread started on first use, and restarted if it stops. While
+    no listener is connected the index may miss other processes' events, so it only keeps
+    what it learns for ``CACHE_TTL_SECONDS`` and falls back to the database for the rest.
+    """
+
+    def __init__(self):
+        self.connected = False
+        self._listener = None
+        self._listener_pid = None
+        self._started_at = None
+        self._lock = threading.Lock()
+
+    def publish_after_commit(self, in_barrier, participant_ids):
+        from dallinger import db
+        from sqlalchemy import event
+
+        participant_ids = [int(participant_id) for participant_id in participant_ids]
+        settled = []
+
+        def on_commit(session):
+            if not settled:
+                settled.append(True)
+                self.publish(in_barrier, participant_ids)
+
+        def on_rollback(session):
+            settled.append(False)  # the entry or release never happened
+
+        session = db.session()
+        event.listen(session, "after_commit", on_commit, once=True)
+        event.listen(session, "after_rollback", on_rollback, once=True)
+
+    def publish(self, in_barrier, participant_ids):
+        barrier_index.apply(in_barrier, participant_ids, EVENT_TTL_SECONDS if self.connected else CACHE_TTL_SECONDS)
+        try:
+            from dallinger.db import redis_conn
+            redis_conn.publish(EVENT_CHANNEL, json.dumps({"in_barrier": in_barrier, "participants": participant_ids, "origin": self.origin()}))
+        except Exception as e:
+            logger.warning("Could not publish barrier event for %s: %s", participant_ids, e)
+
+    @staticmethod
+    def origin():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _listening(self):
+        # a forked web worker inherits the parent's thread object, but not the thread
+        return self._listener_pid == os.getpid() and self._listener is not None and self._listener.is_alive()
+
+    def ensure_listener(self):
+        # one listener per process, restarted (at most every RECONNECT_SECONDS) if it stopped
+        if self._listening():
+            return
+        with self._lock:
+            if self._listening():
+                return
+            now = time.monotonic()
+            if self._listener_pid == os.getpid() and now - self._started_at < RECONNECT_SECONDS:
+                return
+            self.connected = False
+            self._listener_pid = os.getpid()
+            self._started_at = now
+            self._listener = threading.Thread(target=self._listen, name="barrier-event-listener", daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        try:
+            from dallinger.db import redis_conn
+            pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(EVENT_CHANNEL)
+            self.connected = True
+            for message in pubsub.listen():
+                payload = json.loads(message["data"])
+                if payload["origin"] != self.origin():  # our own events were applied when published
+                    barrier_index.apply(payload["in_barrier"], payload["participants"])
+        except Exception as e:
+            logger.warning("Barrier event listener stopped, falling back to the database: %s", e)
+        finally:
+            self.connected = False
+            # events sent while we reconnect are lost, so stop trusting what earlier ones said
+            barrier_index.limit_ttl(CACHE_TTL_SECONDS)
+
+
+barrier_events = BarrierEvents()
+
+
+class NotifyingGroupBarrier(GroupBarrier):
+    """
+    GroupBarrier that publishes arrivals and releases to ``barrier_events``, waking long-polling
+    partners, and records each visit (arrival, release, ``on_release`` duration) as a ``BarrierVisit``.
+    Each release also advances the group's ``barrier_epoch``, after ``on_release`` has run.
+    """
+
+    def __init__(self, *args, on_release=None, **kwargs):
+        super().__init__(*args, on_release=self._timed(on_release) if on_release else None, **kwargs)
+
+    def _timed(self, on_release):
+        def timed_on_release(group, participants):
+            start = time.perf_counter()
+            try:
+                call_function_with_context(on_release, group=group, participants=participants)
+            finally:
+                duration_ms = (time.perf_counter() - start) * 1e3
+                for visit in BarrierVisit.latest([participant.id for participant in participants], self.id).values():
+                    visit.on_release_ms = round(duration_ms, 3)
+        return timed_on_release
+
+    def receive_participant(self, participant):
+        super().receive_participant(participant)
+        BarrierVisit.arrive(participant, self.id, time.time())
+        barrier_events.publish_after_commit(True, [participant.id])
+
+    def choose_who_to_release(self, waiting_participants):
+        released_at = time.time()
+        participants_to_release = super().choose_who_to_release(waiting_participants)
+        if participants_to_release:
+            for visit in BarrierVisit.latest([participant.id for participant in participants_to_release], self.id).values():
+                visit.released = released_at
+            groups = {}
+            for participant in participants_to_release:
+                group = participant.active_sync_groups.get(self.group_type)
+                if group is not None:
+                    groups[group.id] = group
+            for group in groups.values():
+                group.var.set(EPOCH_VAR, group.var.get(EPOCH_VAR, 0) + 1)
+            barrier_events.publish_after_commit(False, [participant.id for participant in participants_to_release])
+        return participants_to_release
+
+
+def session_breakdown(participant, visits, now=None):
+    """
+    Split a participant's session into time spent waiting at barriers and active time.
+
+    ``visits`` are the participant's ``BarrierVisit`` rows. A visit's wait runs from arrival
+    to release plus the ``on_release`` callback, which holds the release until it finishes;
+    a visit still open counts up to ``now``.
+    """
+    now = now or time.time()
+    start = participant.creation_time.timestamp()
+    end = participant.end_time.timestamp() if participant.end_time else now
+    waiting = collections.defaultdict(float)
+    for visit in visits:
+        released = visit.released if visit.released is not None else now
+        waiting[visit.barrier_id] += released - visit.arrived + (visit.on_release_ms or 0) / 1e3
+    total_waiting = sum(waiting.values())
+    return {
+        "participant_id": participant.id,
+        "session_seconds": end - start,
+        "waiting_seconds": total_waiting,
+        "active_seconds": end - start - total_waiting,
+        "waiting_by_barrier": dict(waiting),
+        "barrier_visits": len(visits),
+    }
@@ -0,0 +1,30 @@
+"""
+Per-format encode benchmark: encode time and byte size of a rendered rhythm in each output format.
+
+Run from the experiment directory:
+
+    python -m benchmarks.formats
+"""
+import statistics
+import timeit
+
+from benchmarks.mixing import random_patterns
+from generate_sounds import AUDIO_FORMATS, encode_audio, render_batch
+
+N_PATTERNS = 50
+
+
+def main():
+    print(f"{'format':>6}  {'grid':>4}  {'kit':>16}  {'encode (ms)':>11}  {'bytes':>7}")
+    for grid_size in (4, 8):
+        for kit_type in ('snare+kick', 'hihat+snare+kick'):
+            patterns = random_patterns(grid_size, N_PATTERNS, kit_type=kit_type)
+            audio = render_batch(patterns, grid_size, kit_type)
+            for name, audio_format in AUDIO_FORMATS.items():
+                sizes = [len(encode_audio(row, audio_format)) for row in audio]
+                seconds = min(timeit.repeat(lambda: [encode_audio(row, audio_format) for row in audio], number=1, repeat=3))
+                print(f"{name:>6}  {grid_size:>4}  {kit_type:>16}  {seconds / len(audio) * 1e3:>11.2f}  {statistics.mean(sizes):>7.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Startup-cost benchmark: how long importing the experiment modules takes, and what they pull in.
+
+Each target is imported in a fresh interpreter under ``python -X importtime``, so the numbers
+include everything a web or clock process pays before serving its first request. Run from the
+experiment directory:
+
+    python -m benchmarks.importtime [module ...]
+
+Targets default to ``generate_sounds`` and the experiment package's ``experiment_nori``
+(which needs psynet installed); a target that fails to import is reported and skipped.
+"""
+import os
+import re
+import subprocess
+import sys
+
+EXPERIMENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(EXPERIMENT_DIR)
+DEFAULT_TARGETS = ('generate_sounds', f'{PACKAGE}.experiment_nori')
+AUDIO_MODULES = ('soundfile', 'scipy.signal', 'librosa', 'audioread')
+TOP_N = 10
+REPEAT = 3
+
+# "import time:  self [us] | cumulative | imported package"
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def import_times(target):
+    """Return ({module: cumulative_us}, error) for one cold import of ``target``."""
+    # package targets are imported from the parent directory, like psynet does
+    cwd = os.path.dirname(EXPERIMENT_DIR) if '.' in target else EXPERIMENT_DIR
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times, None
+
+
+def main(targets):
+    for target in targets:
+        runs = []
+        for _ in range(REPEAT):
+            times, error = import_times(target)
+            if error:
+                print(f"{target}: import failed ({error})\n")
+                break
+            runs.append(times)
+        if not runs:
+            continue
+        best = min(runs, key=lambda times: times[target])
+        print(f"{target}: {best[target] / 1e3:.1f} ms cumulative, {len(best)} modules (best of {len(runs)})")
+        loaded = [name for name in AUDIO_MODULES if name in best]
+        print(f"  audio stack loaded at import: {', '.join(loaded) if loaded else 'none'}")
+        slowest = sorted(((us, name) for name, us in best.items() if name != target), reverse=True)[:TOP_N]
+        for us, name in slowest:
+            print(f"  {us / 1e3:>8.1f} ms  {name}")
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or DEFAULT_TARGETS)
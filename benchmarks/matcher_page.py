@@ -0,0 +1,85 @@
+"""
+Matcher page-construction benchmark: building the colour-grid prompt HTML per matcher request.
+
+Compares the previous per-request string concatenation (reproduced below) with
+``matcher_page.ColorGridTemplate``, for shuffle orders that are new to the grid cache and
+for repeats. Run from the experiment directory (node_creation needs psynet installed):
+
+    python -m benchmarks.matcher_page
+"""
+import random
+import statistics
+import time
+
+from generate_sounds import OUTPUT_FORMAT
+from matcher_page import COLOR_PROMPT, ColorGridTemplate, audio_player
+from node_creation import get_color_dict
+
+N_REQUESTS = 2000
+AUDIO_URL = "/audio/4,snare+kick,1000100010001000,0000100000001000"
+
+
+def concatenated_page(shuffled_choices, audio_url):
+    """The matcher prompt as matcher_turn used to build it."""
+    grid_html = audio_player(audio_url, OUTPUT_FORMAT.mimetype) + (
+        "<div id='color-grid' style='display: grid; grid-template-columns: repeat(3, 70px); gap: 5px; justify-content: center;'>"
+    )
+    for i, color in enumerate(shuffled_choices):
+        hsl = get_color_dict()[color]
+        grid_html += (
+            f"<div class='color-cube' "
+            f"data-color='{color}' "
+            f"style='background-color: hsl({hsl[0]}, {hsl[1]}%, {hsl[2]}%); "
+            "width: 60px; height: 60px; border-radius: 50%; border: 1px solid black; cursor: pointer;'></div>"
+        )
+    grid_html += "</div>"
+    grid_html += """
+    <script>
+    document.querySelectorAll('.color-cube').forEach(function(el, idx) {
+        el.onclick = function() {
+            var btns = document.querySelectorAll('button');
+            btns[idx].click();
+        }
+    });
+    </script>
+    """
+    return COLOR_PROMPT + grid_html
+
+
+def measure(fn, orders):
+    times = []
+    for order in orders:
+        start = time.perf_counter_ns()
+        fn(order)
+        times.append((time.perf_counter_ns() - start) / 1e3)
+    return statistics.median(times), statistics.quantiles(times, n=20)[18]
+
+
+def shuffled_orders(colors, n, seed):
+    rng = random.Random(seed)
+    orders = []
+    for _ in range(n):
+        order = list(colors)
+        rng.shuffle(order)
+        orders.append(order)
+    return orders
+
+
+def main():
+    colors = list(get_color_dict())
+    orders = shuffled_orders(colors, N_REQUESTS, seed=0)
+    template = ColorGridTemplate(get_color_dict())
+
+    rows = [
+        ('concatenation', measure(lambda order: concatenated_page(order, AUDIO_URL), orders)),
+        ('template, new order', measure(lambda order: template.render(order, AUDIO_URL, OUTPUT_FORMAT.mimetype), orders)),
+        ('template, cached order', measure(lambda order: template.render(order, AUDIO_URL, OUTPUT_FORMAT.mimetype), orders)),
+    ]
+    print(f"{N_REQUESTS} matcher requests, {len(colors)} colours")
+    print(f"{'construction':>24}  {'p50 (us)':>9}  {'p95 (us)':>9}")
+    for name, (p50, p95) in rows:
+        print(f"{name:>24}  {p50:>9.2f}  {p95:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Simulated grouper queue: how long participants wait for a partner at different arrival rates.
+
+Participants reach the grouper as a Poisson process, at the rates a Prolific study sees
+(per minute). The grouper is checked every 0.5 s, like psynet's clock process, and pairs
+whoever is waiting, as SimpleGrouper(initial_group_size=2) does; anyone still unpaired after
+``max_wait_time`` leaves. For each rate the benchmark reports the median and p95 wait and the
+share of timeouts. Run from the experiment directory:
+
+    python -m benchmarks.matchmaking [--participants 1000] [--max-wait-time 300]
+"""
+import argparse
+import random
+import statistics
+
+RATES_PER_MINUTE = (0.5, 1, 2, 4, 8, 16)
+CHECK_INTERVAL = 0.5
+
+
+def arrivals(n, rate_per_minute, seed):
+    """Arrival times of a Poisson process, in seconds."""
+    rng = random.Random(seed)
+    t = 0.0
+    times = []
+    for _ in range(n):
+        t += rng.expovariate(rate_per_minute / 60)
+        times.append(t)
+    return times
+
+
+def simulate(arrival_times, max_wait_time):
+    """Run the grouper checks over the arrivals; return (waits, timeouts)."""
+    pending = list(arrival_times)
+    queue = []
+    waits = []
+    timeouts = 0
+    now = 0.0
+    while pending or queue:
+        now += CHECK_INTERVAL
+        while pending and pending[0] <= now:
+            queue.append(pending.pop(0))
+        while len(queue) >= 2:
+            waits += [now - queue.pop(0), now - queue.pop(0)]
+        if queue and now - queue[0] > max_wait_time:
+            queue.pop(0)
+            timeouts += 1
+    return waits, timeouts
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.matchmaking')
+    parser.add_argument('--participants', type=int, default=1000, help="arrivals simulated per rate")
+    parser.add_argument('--max-wait-time', type=float, default=300, help="the grouper's max_wait_time, in seconds")
+    args = parser.parse_args()
+
+    print(f"{'rate/min':>8}  {'median (s)':>10}  {'p95 (s)':>8}  {'timeouts':>8}")
+    for rate in RATES_PER_MINUTE:
+        waits, timeouts = simulate(arrivals(args.participants, rate, seed=int(rate * 100)), args.max_wait_time)
+        p95 = statistics.quantiles(waits, n=20, method='inclusive')[18]
+        print(f"{rate:>8}  {statistics.median(waits):>10.1f}  {p95:>8.1f}  {timeouts / args.participants:>8.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: onset-array mixing vs. the original per-step Python loop.
+
+Also times a single ``np.bincount`` scatter-add over every hit, which is the obvious
+"one NumPy call" alternative but has to build an int64 index per mixed sample.
+
+Run from the experiment directory:
+
+    python -m benchmarks.mixing
+"""
+import random
+import timeit
+
+import numpy as np
+
+import generate_sounds
+from generate_sounds import (
+    BASE_STEPS, KIT_DRUMS, SAMPLE_RATE, STEP_TIME, Pattern, mix_onsets, pattern_onsets, sample_bank,
+)
+
+KIT = 'hihat+snare+kick'
+N_PATTERNS = 200
+TOTAL_SAMPLES = int(BASE_STEPS * STEP_TIME * SAMPLE_RATE)
+
+
+def loop_mix(pattern):
+    """The mixing loop generate_pattern_audio used before onset arrays."""
+    hihat, snare, kick = (sample_bank.get(drum) for drum in ('hihat', 'snare', 'kick'))
+    samples = {'hihat': hihat, 'snare': snare, 'kick': kick}
+    grid_size = pattern.grid_size
+    beat_duration = STEP_TIME * BASE_STEPS / grid_size
+    audio = np.zeros(int(grid_size * beat_duration * SAMPLE_RATE))
+    patterns = {drum: pattern.row_steps(i) for i, drum in enumerate(KIT_DRUMS[pattern.kit_type])}
+    for i in range(grid_size):
+        pos = int(i * beat_duration * SAMPLE_RATE)
+        for drum in ('hihat', 'snare', 'kick'):
+            if drum in patterns and i < len(patterns[drum]) and patterns[drum][i] == '1':
+                end_pos = min(pos + len(samples[drum]), len(audio))
+                audio[pos:end_pos] += samples[drum][:end_pos - pos]
+    return audio
+
+
+def onset_mix(pattern):
+    return mix_onsets(pattern_onsets(pattern), TOTAL_SAMPLES)
+
+
+def scatter_add_mix(pattern):
+    indices, weights = [], []
+    for drum, positions in pattern_onsets(pattern).items():
+        sample = sample_bank.get(drum)
+        idx = (positions[:, None] + np.arange(len(sample))).ravel()
+        keep = idx < TOTAL_SAMPLES
+        indices.append(idx[keep])
+        weights.append(np.broadcast_to(sample, (len(positions), len(sample))).ravel()[keep])
+    return np.bincount(np.concatenate(indices), weights=np.concatenate(weights), minlength=TOTAL_SAMPLES)
+
+
+def random_patterns(grid_size, n, seed=0, kit_type=KIT):
+    rng = random.Random(seed)
+    n_bits = grid_size * len(KIT_DRUMS[kit_type])
+    return [Pattern.from_code(rng.getrandbits(n_bits), grid_size, kit_type) for _ in range(n)]
+
+
+def main():
+    sample_bank.preload()
+    # the old loop cut sample tails off at the end of the cycle; compare like with like
+    generate_sounds.SEAMLESS_LOOP = False
+    mixers = (('loop', loop_mix), ('onsets', onset_mix), ('scatter-add', scatter_add_mix))
+    print(f"{'grid':>4}" + ''.join(f"  {name + ' (us)':>16}" for name, _ in mixers) + f"  {'loop/onsets':>11}")
+    for grid_size in (4, 8, 16):
+        patterns = random_patterns(grid_size, N_PATTERNS)
+        for pattern in patterns[:10]:
+            reference = loop_mix(pattern)
+            for _, mix in mixers[1:]:
+                assert np.allclose(reference, mix(pattern), atol=1e-5)
+        timings = {}
+        for name, mix in mixers:
+            best = min(timeit.repeat(lambda: [mix(p) for p in patterns], number=1, repeat=5))
+            timings[name] = best / len(patterns) * 1e6
+        print(f"{grid_size:>4}" + ''.join(f"  {timings[name]:>16.1f}" for name, _ in mixers)
+              + f"  {timings['loop'] / timings['onsets']:>10.2f}x")
+
+
+if __name__ == '__main__':
+    main()
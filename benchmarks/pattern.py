@@ -0,0 +1,55 @@
+"""
+Micro-benchmarks for the Pattern value type against the string handling it replaced.
+
+Run from the experiment directory:
+
+    python -m benchmarks.pattern
+"""
+import re
+import timeit
+
+from benchmarks.mixing import random_patterns
+from generate_sounds import Pattern
+
+N = 20000
+
+
+def regex_parse(director_sound_str):
+    """How parse_and_generate_audio parsed answers before Pattern."""
+    if director_sound_str.endswith('_'):
+        director_sound_str = director_sound_str[:-1]
+    patterns = {}
+    for drum in ['hihat', 'snare', 'kick']:
+        pattern_match = re.search(f'{drum}_([01]+)', director_sound_str)
+        if pattern_match:
+            patterns[drum] = pattern_match.group(1)
+    return patterns
+
+
+def per_op_ns(fn, items):
+    best = min(timeit.repeat(lambda: [fn(item) for item in items], number=1, repeat=5))
+    return best / len(items) * 1e9
+
+
+def main():
+    for grid_size in (4, 8, 16):
+        patterns = random_patterns(grid_size, N, seed=grid_size)
+        strings = [p.to_string() + '_' for p in patterns]
+        twins = [Pattern.from_string(s) for s in strings]
+        string_twins = [''.join(s) for s in strings]  # equal but distinct string objects
+
+        results = {
+            'regex parse': per_op_ns(regex_parse, strings),
+            'Pattern.from_string': per_op_ns(Pattern.from_string, strings),
+            'Pattern.to_string': per_op_ns(Pattern.to_string, patterns),
+            'str ==': per_op_ns(lambda i: strings[i] == string_twins[i], range(N)),
+            'Pattern ==': per_op_ns(lambda i: patterns[i] == twins[i], range(N)),
+            'hash(Pattern)': per_op_ns(hash, patterns),
+        }
+        print(f"grid {grid_size}:")
+        for name, ns in results.items():
+            print(f"  {name:>20}  {ns:8.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Stage-by-stage benchmark of the generate_sounds pipeline, with JSON results for comparing commits.
+
+Times each stage separately (decode, parse, mix, normalize, encode, write) and end to end
+through ``render_pattern_bytes``, for every grid size and kit, with cold and warm caches where
+a stage has one. Reports p50/p95 latency and the peak memory each call allocates
+(tracemalloc, which numpy reports its buffers to).
+
+Run from the experiment directory:
+
+    python -m benchmarks.pipeline [--n 50] [--output results.json] [--compare old.json]
+
+Results go to benchmarks/results/pipeline-<commit>.json by default. Every cache and bank the
+benchmark touches lives in a temporary directory, so it never writes into static/.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import generate_sounds
+from benchmarks.mixing import random_patterns
+from generate_sounds import (
+    BASE_STEPS, KIT_DRUMS, OUTPUT_FORMAT, SAMPLE_RATE, STEP_TIME, Pattern, RenderBank, SampleBank,
+    encode_audio, get_render_bank, loop_cycles, mix_onsets, pattern_onsets, render_pattern_bytes,
+)
+
+GRID_SIZES = (4, 8)
+TOTAL_SAMPLES = int(BASE_STEPS * STEP_TIME * SAMPLE_RATE)
+ALLOC_CALLS = 10  # tracemalloc slows every allocation, so it gets its own shorter pass
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def measure(fn, inputs, setup=None):
+    """p50/p95 latency over ``inputs`` and the median peak allocation of a call."""
+    times = []
+    for item in inputs:
+        if setup:
+            setup()
+        start = time.perf_counter_ns()
+        fn(item)
+        times.append((time.perf_counter_ns() - start) / 1e3)
+
+    peaks = []
+    tracemalloc.start()
+    for item in inputs[:ALLOC_CALLS]:
+        if setup:
+            setup()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn(item)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    return {
+        'n': len(times),
+        'p50_us': round(statistics.median(times), 1),
+        'p95_us': round(statistics.quantiles(times, n=20)[18], 1) if len(times) > 1 else round(times[0], 1),
+        'alloc_peak_kb': round(statistics.median(peaks) / 1024, 1),
+    }
+
+
+class Scratch:
+    """Empty, isolated render banks under a temporary root."""
+
+    def __init__(self, root):
+        self.bank_dir = os.path.join(root, 'render_bank')
+        self.reset()
+
+    def reset(self):
+        shutil.rmtree(self.bank_dir, ignore_errors=True)
+        # the module looks banks up by (grid, kit); point every lookup at the scratch directory
+        for grid_size in GRID_SIZES:
+            for kit_type in KIT_DRUMS:
+                generate_sounds._render_banks[grid_size, kit_type] = RenderBank(grid_size, kit_type, self.bank_dir)
+
+
+def normalize(audio):
+    peak = np.max(np.abs(audio))
+    return audio / peak if peak > 0 else audio
+
+
+def run(n, root):
+    scratch = Scratch(root)
+    results = []
+
+    def record(stage, grid_size, kit_type, cache, stats):
+        results.append({'stage': stage, 'grid': grid_size, 'kit': kit_type, 'cache': cache, **stats})
+
+    # decode: cold decodes the MP3s and writes the sample table, warm maps the existing table
+    sample_dir = os.path.join(root, 'samples')
+    cold_dirs = itertools.count()
+    record('decode', None, None, 'cold', measure(
+        lambda _: SampleBank(cache_dir=os.path.join(sample_dir, str(next(cold_dirs)))).preload(), range(n)))
+    SampleBank(cache_dir=sample_dir).preload()
+    record('decode', None, None, 'warm', measure(lambda _: SampleBank(cache_dir=sample_dir).preload(), range(n)))
+
+    # render from the warm scratch table rather than the deployment's sample cache
+    generate_sounds.sample_bank = SampleBank(cache_dir=sample_dir).preload()
+    write_dir = os.path.join(root, 'write')
+    os.makedirs(write_dir)
+    for grid_size in GRID_SIZES:
+        for kit_type in KIT_DRUMS:
+            patterns = random_patterns(grid_size, n, kit_type=kit_type)
+            strings = [p.to_string() for p in patterns]
+            onsets = [pattern_onsets(p) for p in patterns]
+            mixed = [mix_onsets(o, TOTAL_SAMPLES) for o in onsets]
+            looped = [loop_cycles(normalize(audio)) for audio in mixed]
+            encoded = [encode_audio(audio) for audio in looped]
+
+            record('parse', grid_size, kit_type, None, measure(Pattern.from_string, strings))
+            record('mix', grid_size, kit_type, None, measure(lambda o: mix_onsets(o, TOTAL_SAMPLES), onsets))
+            record('normalize', grid_size, kit_type, None, measure(lambda a: loop_cycles(normalize(a)), mixed))
+            record('encode', grid_size, kit_type, None, measure(encode_audio, looped))
+
+            def write(data):
+                fd, tmp_path = tempfile.mkstemp(dir=write_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, os.path.join(write_dir, f'out.{OUTPUT_FORMAT.extension}'))
+            record('write', grid_size, kit_type, None, measure(write, encoded))
+
+            # end to end: cold renders into empty banks, warm reads renders the offline build stored
+            record('render_pattern_bytes', grid_size, kit_type, 'cold', measure(render_pattern_bytes, patterns, setup=scratch.reset))
+            bank = get_render_bank(grid_size, kit_type)
+            for pattern, data in zip(patterns, encoded):
+                if pattern not in bank:
+                    bank.put(pattern, data)
+            record('render_pattern_bytes', grid_size, kit_type, 'warm', measure(render_pattern_bytes, patterns))
+            print(f"grid {grid_size} {kit_type}: done")
+    return results
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if dirty else commit
+
+
+def key(result):
+    return result['stage'], result['grid'], result['kit'], result['cache']
+
+
+def print_table(results, baseline=None):
+    base = {key(r): r for r in baseline['results']} if baseline else {}
+    header = f"{'stage':>20}  {'grid':>4}  {'kit':>16}  {'cache':>5}  {'p50 (us)':>10}  {'p95 (us)':>10}  {'alloc (KB)':>10}"
+    print(header + (f"  {'p50 vs base':>11}" if base else ''))
+    for r in results:
+        line = (f"{r['stage']:>20}  {r['grid'] or '-':>4}  {r['kit'] or '-':>16}  {r['cache'] or '-':>5}"
+                f"  {r['p50_us']:>10.1f}  {r['p95_us']:>10.1f}  {r['alloc_peak_kb']:>10.1f}")
+        if key(r) in base:
+            line += f"  {r['p50_us'] / base[key(r)]['p50_us']:>10.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.pipeline')
+    parser.add_argument('--n', type=int, default=50, help="calls per stage and configuration")
+    parser.add_argument('--output', help="JSON results path (default: benchmarks/results/pipeline-<commit>.json)")
+    parser.add_argument('--compare', help="earlier JSON results to compare p50 latencies against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    root = tempfile.mkdtemp(prefix='pipeline-bench-')
+    try:
+        results = run(args.n, root)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sample_rate': SAMPLE_RATE,
+        'format': OUTPUT_FORMAT.name,
+        'results': results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"comparing against {baseline['commit']} ({args.compare})")
+    print_table(results, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'pipeline-{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
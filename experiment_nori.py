@@ -1,15 +1,16 @@
+import collections
 import random
 from itertools import accumulate
 from typing import List
 
 from dominate import tags
-from librosa.feature import rhythm
+from flask_login import login_required
 from markupsafe import Markup
 
 import psynet.experiment
 from .consent import CustomConsent
 from .dat import dat
-from .generate_sounds import parse_and_generate_audio
+from .generate_sounds import AUDIO_ROUTE, OUTPUT_FORMAT, Pattern, audio_cache_key, audio_log, metrics, render_service, rhythm_audio_url
 from .node_creation import get_nodes, get_testing_nodes, get_color_dict
 from .questionnaire import questionnaire
 from psynet.consent import NoConsent
@@ -26,11 +27,20 @@ from psynet.experiment import get_experiment, experiment_route
 from psynet.prescreen import ColorBlindnessTest, AudioForcedChoiceTest
 from psynet.asset import S3Storage
 from .wait_video_old import video_wait_page
+from .wait_video import barrier_wait_page
+from .barrier_visits import BarrierVisit
+from .barriers import NotifyingGroupBarrier, barrier_index, session_breakdown
+from .matcher_page import ColorGridTemplate, audio_player
+from .rhythm_history import RhythmAttempt
+from .roles import role_registry
+from .vars_update import VarsUpdate
 
 #import pydevd_pycharm
 
 logger = get_logger()
 
+color_grid = ColorGridTemplate(get_color_dict())
+
 
 class ColorCubeControl(Control):
     macro = "color_cube"
@@ -97,16 +107,13 @@ class SigSpaceTrial(StaticTrial):
     # pydevd_pycharm.settrace('localhost', port=12345, stdoutToServer=True, stderrToServer=True),
 
     def is_answer_correct(self, participant):
-        if participant.sync_group is None:
+        roles = role_registry.for_participant(participant)  # director/producer and matcher/rater
+        if roles is None:
             return False
-        sync_group = participant.sync_group
-        director = next((p for p in sync_group.participants if p == sync_group.leader))  # get director/producer
-
-        # if rhythm is in this node, then check for correct answer (otherwise it's the first trial of node)
-        if director.vars.get("node_rhythms"):
-            matcher = next((p for p in sync_group.participants if p != sync_group.leader))  # Get the matcher/rater
 
-            matcher_answer = matcher.vars.get("last_action")
+        # if the pair has a rhythm for this node, then check for correct answer (otherwise it's the first trial of node)
+        if RhythmAttempt.latest(roles.group_id, self.node_id) is not None:
+            matcher_answer = roles.matcher_vars.get("last_action")
 
             if self.definition["domain"] == "communication":
                 return matcher_answer == self.definition["color"]
@@ -132,9 +139,10 @@ class SigSpaceTrial(StaticTrial):
             # Use participant's own completion state
                 # Continue looping as long as the current node is NOT completed for this participant
                 join(
-                    GroupBarrier(
+                    NotifyingGroupBarrier(
                         id_="wait_for_trial",
                         group_type="sig_space_groups",
+                        waiting_logic=barrier_wait_page(),
                         max_wait_time=300,
                     ),
                     conditional(
@@ -146,27 +154,27 @@ class SigSpaceTrial(StaticTrial):
                         logic_if_true=PageMaker(self.show_director_message, time_estimate=30),
                     ),
                     self.director_turn(participant=participant),
-                    GroupBarrier(
+                    NotifyingGroupBarrier(
                         id_="director_finished_trial",
                         group_type="sig_space_groups",
+                        waiting_logic=barrier_wait_page(),
                         on_release=self.save_director_answer,
                         max_wait_time=300,
                     ),
                     self.matcher_turn(participant=participant),
-                    GroupBarrier(
+                    NotifyingGroupBarrier(
                         id_="matcher_finished_trial",
                         group_type="sig_space_groups",
+                        waiting_logic=barrier_wait_page(),
                         on_release=self.save_matcher_answer,
                         max_wait_time=300,
                     ),
-                    WaitPage(
-                        1,
-                        content="Waiting for your partner...",
-                    ),
+                    barrier_wait_page(),
                     self.feedback_page(experiment=experiment, participant=participant),
-                    GroupBarrier(
+                    NotifyingGroupBarrier(
                         id_="trial_completed",
                         group_type="sig_space_groups",
+                        waiting_logic=barrier_wait_page(),
                         max_wait_time=300,
                     ),
                 ),
@@ -197,14 +205,20 @@ class SigSpaceTrial(StaticTrial):
             time_estimate=60
         )
 
+    def latest_rhythm(self, participant):
+        """The pair's last rhythm for this node, to pre-fill the drum machine, or None on the first attempt."""
+        attempt = RhythmAttempt.latest(participant.sync_group.id, self.node_id)
+        if attempt is None:
+            return None
+        return Pattern.from_code(attempt.pattern_code, attempt.grid_size, attempt.drum_kit).to_string()
+
     def director_turn(self, participant):
         if participant.sync_group.leader == participant:  # = is participant the leader
+            rhythm = self.latest_rhythm(participant)
 
             if self.definition["domain"] == "communication":
                 current_color = self.definition.get("color")
                 director_color_hsl = get_color_dict().get(current_color)
-                director.current_trial.node.definition["node_rhythm"] = None  # reset director rhythm for this node
-                #rhythm = participant.vars.get("node_rhythms", {}).get(current_color)
 
                 if rhythm:  # Check if exists a rhythm for this node show the pre-filled drum machine
                     return join(
@@ -240,9 +254,6 @@ class SigSpaceTrial(StaticTrial):
                     )
 
             else:   # self.definition["domain"] == "music"  # todo: need to check if appealing as well
-                current_melody = self.definition.get("melody")
-                rhythm = participant.vars.get("node_rhythms", {}).get(current_melody)
-
                 if rhythm:
                     return join(
                         ModularPage(
@@ -276,63 +287,54 @@ class SigSpaceTrial(StaticTrial):
                     )
         else:
             return join(
-                WaitPage(
-                    wait_time=1,
-                    content='Waiting for your partner...',
-                )
+                barrier_wait_page('Waiting for your partner...'),
             )
 
-    def save_director_answer(self, participants: List[Participant]):
-        for participant in participants:
-            if participant.sync_group.leader == participant:  # = director
-                # Get the current node content from the trial definition
-                # Need to access the trial definition through the experiment
-                experiment = get_experiment()
-                current_trial = participant.current_trial
-                if current_trial:
-                    node_content = current_trial.definition.get("color") if self.definition["domain"] == "communication" else current_trial.definition.get("melody")
-                else:
-                    print("ERROR - No current trial found")
-                    continue
-
-                # Always get the current rhythm from last_action
-                answer = participant.vars.get("last_action")
-                self.node.var.director_rhythm = answer
-
-                # Check if we already have a rhythm for this node
-                existing_rhythm = participant.vars.get("node_rhythms", {}).get(node_content)
+    def save_director_answer(self, group, participants: List[Participant]):
+        roles = role_registry.get(group)
+        # every vars change below is written in one assignment per participant
+        with VarsUpdate("director_finished_trial") as update:
+            for participant in participants:
+                if roles.is_director(participant):
+                    # Get the current node content from the trial definition
+                    current_trial = participant.current_trial
+                    if current_trial:
+                        node_content = current_trial.definition.get("color") if self.definition["domain"] == "communication" else current_trial.definition.get("melody")
+                    else:
+                        print("ERROR - No current trial found")
+                        continue
 
-                if existing_rhythm and existing_rhythm is not None and answer == existing_rhythm:
-                    # Rhythm hasn't changed - reuse existing audio
-                    audio_filename = participant.vars.get("node_audio_filenames", {}).get(node_content)
-                else:
-                    # New or modified rhythm - store it and generate new audio
-                    if "node_rhythms" not in participant.vars:
-                        participant.vars["node_rhythms"] = {}
-                    participant.vars["node_rhythms"][node_content] = answer
-
-                    # Generate audiofile for the rhythm
-                    try:
-
-                        audio_filename = parse_and_generate_audio(answer)
-                            
-                            # Store the audio filename for this node
-                        if "node_audio_filenames" not in participant.vars:
-                            participant.vars["node_audio_filenames"] = {}
-                        participant.vars["node_audio_filenames"][node_content] = audio_filename
-
-                        if "node_rhythms" not in participant.vars:
-                            participant.vars["node_rhythms"] = {}
-                        participant.vars["node_rhythms"][node_content] = answer
-                    except Exception as e:
-                        raise Exception(f"Audio generation failed for rhythm '{answer}': {str(e)}")
-
-                # save to participant vars so matcher can access
-                for participant in participants:
-                    if participant.sync_group.leader != participant:  # = matcher
-                        participant.vars["director_answer"] = answer
-                        if audio_filename:
-                            participant.vars["audio_filename"] = audio_filename
+                    # Always get the current rhythm from last_action
+                    answer = update.get(participant, "last_action")
+                    self.node.var.director_rhythm = answer
+                    if not answer:
+                        raise Exception("Audio generation failed: the director sent no rhythm")
+                    pattern = Pattern.from_string(answer)
+                    audio_key = audio_cache_key(pattern)
+
+                    # The pair's previous attempt at this node, if any
+                    previous = RhythmAttempt.latest(group.id, current_trial.node_id)
+                    RhythmAttempt.record(group.id, current_trial, participant.id, roles.matcher_id, node_content,
+                                         pattern, audio_key)
+
+                    if previous is None or previous.audio_key != audio_key:
+                        # New or modified rhythm - start rendering in the background so the barrier
+                        # releases straight away; the render is published to redis, where
+                        # Exp.rhythm_audio on any web dyno finds it
+                        try:
+                            render_service.submit(answer)
+                        except Exception as e:
+                            # never fail the release: the audio route renders the rhythm inline instead
+                            audio_log.warning(f"Background render of {answer} could not be started: {e}")
+                    # an unchanged rhythm reuses the audio rendered for the previous attempt
+                    audio_url = rhythm_audio_url(answer)
+
+                    # save to participant vars so matcher can access
+                    for other in participants:
+                        if roles.is_matcher(other):
+                            update.set(other, "director_answer", answer)
+                            if audio_url:
+                                update.set(other, "audio_url", audio_url)
 
     def matcher_turn(self, participant):
         if participant.sync_group.leader != participant:  # = matcher
@@ -345,82 +347,19 @@ class SigSpaceTrial(StaticTrial):
                         time_estimate=5
                     )
 
-                audio_filename = parse_and_generate_audio(director_answer)  # generate here (instead of reading file from director)
-
-                # Create audio player HTML
-                audio_player_html = f"""
-                <div style='margin-bottom: 20px; text-align: center;'>
-                    <audio id='rhythm-audio' autoplay loop style='display: none;'>
-                        <source src='/static/{audio_filename}' type='audio/mp3'>
-                        Your browser does not support the audio element.
-                    </audio>
-                    <script>
-                        // Auto-play the audio when the page loads
-                        window.addEventListener('load', function() {{
-                            var audio = document.getElementById('rhythm-audio');
-                            // Ensure the audio loops seamlessly like the drum machine
-                            audio.loop = true;
-                            audio.volume = 1.0;
-                            audio.play().catch(function(error) {{
-                                console.log('Audio playback failed:', error);
-                            }});
-                        }});
-                        
-                        // Ensure audio continues playing even if interrupted
-                        document.addEventListener('visibilitychange', function() {{
-                            var audio = document.getElementById('rhythm-audio');
-                            if (!document.hidden && audio.paused) {{
-                                audio.play().catch(function(error) {{
-                                    console.log('Audio playback failed:', error);
-                                }});
-                            }}
-                        }});
-                    </script>
-                </div>
-                """
+                # Streamed by Exp.rhythm_audio from memory or redis; any web dyno can render it on a miss
+                audio_url = rhythm_audio_url(director_answer)
 
                 if self.definition["domain"] == "communication":
-                    # Communication domain: Show color grid
-                    choices = list(get_color_dict().keys())
-                    # Shuffle the color choices for each trial
-                    shuffled_choices = choices.copy()
+                    # Communication domain: Show color grid, shuffled for each trial
+                    shuffled_choices = list(color_grid.colors)
                     random.shuffle(shuffled_choices)
-                    
-                    # build the grid HTML
-                    grid_html = (
-                        f"{audio_player_html}"
-                        "<div id='color-grid' style='display: grid; grid-template-columns: repeat(3, 70px); gap: 5px; justify-content: center;'>"
-                    )
-                    for i, color in enumerate(shuffled_choices):
-                        hsl = get_color_dict()[color]
-                        grid_html += (
-                            f"<div class='color-cube' "
-                            f"data-color='{color}' "
-                            f"style='background-color: hsl({hsl[0]}, {hsl[1]}%, {hsl[2]}%); "
-                            "width: 60px; height: 60px; border-radius: 50%; border: 1px solid black; cursor: pointer;'></div>"
-                        )
-                    grid_html += "</div>"
-                    # Add JS to trigger the hidden button
-                    grid_html += """
-                    <script>
-                    document.querySelectorAll('.color-cube').forEach(function(el, idx) {
-                        el.onclick = function() {
-                            // Find the corresponding hidden button and click it
-                            var btns = document.querySelectorAll('button');
-                            btns[idx].click();
-                        }
-                    });
-                    </script>
-                    """
 
                     # Create hidden PushButtonControl with shuffled choices
                     hidden_labels = ["" for _ in shuffled_choices]  # No visible label
                     return ModularPage(
                         "matcher-task",
-                        Prompt(Markup(
-                            "<div style='text-align:center;'>Your partner produced this rhythm. What color were they referring to?</div><br>" +
-                            grid_html
-                        )),
+                        Prompt(Markup(color_grid.render(shuffled_choices, audio_url, OUTPUT_FORMAT.mimetype))),
                         PushButtonControl(
                             shuffled_choices,  # Use shuffled choices
                             labels=hidden_labels,
@@ -436,7 +375,7 @@ class SigSpaceTrial(StaticTrial):
                         "matcher-task",
                         Prompt(Markup(
                             "<div style='text-align:center;'>Your partner produced this rhythm. What do you think of this rhythm?</div><br>" +
-                            audio_player_html +
+                            audio_player(audio_url, OUTPUT_FORMAT.mimetype) +
                             "<style>.btn-primary { background-color: black !important; border-color: black !important; color: white !important; }</style>"
                         )),
                         PushButtonControl(
@@ -456,30 +395,30 @@ class SigSpaceTrial(StaticTrial):
             #     )
         else:  # director sees this
             return join(
-                WaitPage(
-                    1,
-                    content='Waiting for your partner...',
-                )
+                barrier_wait_page('Waiting for your partner...'),
             )
 
-    def save_matcher_answer(self, participants: List[Participant]):
+    def save_matcher_answer(self, group, participants: List[Participant]):
         #try:
-            for participant in participants:
-                if participant.sync_group.leader != participant:  # matcher/rater
-                    matcher_choice = participant.vars.get("last_action")
-                    if not(matcher_choice):
-                        continue
-                    participant.vars["answer"] = matcher_choice
+            roles = role_registry.get(group)
+            with VarsUpdate("matcher_finished_trial") as update:
+                for participant in participants:
+                    if roles.is_matcher(participant):
+                        matcher_choice = update.get(participant, "last_action")
+                        if not(matcher_choice):
+                            continue
+                        update.set(participant, "answer", matcher_choice)
+                        if participant.current_trial:
+                            RhythmAttempt.record_choice(group.id, participant.current_trial.node_id, matcher_choice)
         #except:
         #    pass
 
     def feedback_page(self, experiment, participant):
+        roles = role_registry.for_participant(participant)
         if self.definition["domain"] == "communication":
-            sync_group = participant.sync_group
-            matcher = next((p for p in sync_group.participants if p != sync_group.leader))
-            matcher_choice = matcher.vars.get("last_action")
+            matcher_choice = roles.matcher_vars.get("last_action")
 
-            if participant.sync_group.leader != participant:  # = is participant the matcher
+            if not roles.is_director(participant):  # = is participant the matcher
                 if matcher_choice == self.definition["color"]:  # Successful
                     prompt = Markup(f"<strong>Successful!</strong><br><br>"
                                     f"You guessed the right color.<br>")
@@ -495,18 +434,16 @@ class SigSpaceTrial(StaticTrial):
                                     f"Your partner guessed the wrong color. Try again!<br>")
 
         elif self.definition["domain"] == "music":
-            sync_group = participant.sync_group
-            matcher = next((p for p in sync_group.participants if p != sync_group.leader))
-            matcher_choice = matcher.vars.get("last_action")
+            matcher_choice = roles.matcher_vars.get("last_action")
 
-            if participant.sync_group.leader != participant:  # matcher
+            if not roles.is_director(participant):  # matcher
                 if matcher_choice == "Appealing":
                     prompt = Markup(f"<strong>Successful!</strong><br><br>"
                                 f"You found your partner's rhythm appealing.")
                 else:
                     prompt = Markup(f"<strong>Unsuccessful!</strong><br><br>"
                                 f"You did not find your partner's rhythm appealing.")
-            elif participant.sync_group.leader == participant:  # director
+            elif roles.is_director(participant):  # director
                 if matcher_choice == "Appealing":
                     prompt = Markup(f"<strong>Successful!</strong><br><br>"
                                 f"Your partner found your rhythm appealing.")
@@ -636,13 +573,137 @@ class Exp(psynet.experiment.Experiment):
         #self.all_nodes = nodes  # Initialize the list of all nodes
         self.current_node_index = 0  # Start with the first node
 
+    @staticmethod
+    def load_in_barrier(participant_id):
+        from dallinger import db
+        from flask import abort
+        from psynet.participant import Participant
+        # end the transaction so each check sees releases committed by the clock process
+        db.session.rollback()
+        participant = Participant.query.get(participant_id)
+        if participant is None:
+            abort(404)
+        return len(participant.active_barriers) > 0
+
     @experiment_route("/participant_in_barrier/<participant_id>", methods=["GET"])
     @classmethod
     def participant_in_barrier(cls, participant_id):
-        from psynet.participant import Participant
         from flask import jsonify
-        participant = Participant.query.get(participant_id)
-        return jsonify(len(participant.active_barriers) > 0)
+        return jsonify(barrier_index.lookup(participant_id, lambda: cls.load_in_barrier(participant_id)))
+
+    @experiment_route("/participant_in_barrier/<participant_id>/wait", methods=["GET"])
+    @classmethod
+    def participant_in_barrier_wait(cls, participant_id):
+        """Long-poll: answer once the participant's barrier state differs from ?in_barrier, or after ~20 s."""
+        from flask import jsonify, request
+        known = request.args.get("in_barrier", "true") == "true"
+        state = {}
+
+        def changed():
+            state["in_barrier"] = barrier_index.lookup(participant_id, lambda: cls.load_in_barrier(participant_id))
+            return state["in_barrier"] != known
+
+        barrier_index.wait_until(participant_id, changed)
+        return jsonify(state)
+
+    @experiment_route("/barrier_waits", methods=["GET"])
+    @classmethod
+    @login_required
+    def barrier_waits(cls):
+        """Each pair's sessions split into waiting-at-barrier and active time, from their barrier visits (dashboard login)."""
+        from flask import jsonify
+        from psynet.sync import ParticipantLinkSyncGroup, SyncGroup
+        from sqlalchemy.orm import selectinload
+        groups = (
+            SyncGroup.query.filter_by(group_type="sig_space_groups")
+            .options(selectinload(SyncGroup.participant_links).selectinload(ParticipantLinkSyncGroup.participant))
+            .order_by(SyncGroup.id)
+            .all()
+        )
+        participant_ids = {link.participant_id for group in groups for link in group.participant_links}
+        visits = collections.defaultdict(list)
+        for visit in BarrierVisit.query.filter(BarrierVisit.participant_id.in_(participant_ids)).order_by(BarrierVisit.id):
+            visits[visit.participant_id].append(visit)
+        return jsonify([
+            {
+                "group_id": group.id,
+                "participants": [session_breakdown(p, visits[p.id]) for p in group.participants],
+            }
+            for group in groups
+        ])
+
+    @experiment_route("/rhythm_history.csv", methods=["GET"])
+    @classmethod
+    @login_required
+    def rhythm_history_csv(cls):
+        """Every director attempt with the matcher's choice, streamed as CSV (dashboard login)."""
+        from flask import Response, stream_with_context
+        return Response(
+            stream_with_context(RhythmAttempt.export_csv()),
+            mimetype="text/csv",
+            headers={"Content-Disposition": "attachment; filename=rhythm_history.csv"},
+        )
+
+    @experiment_route("/matchmaking_stats", methods=["GET"])
+    @classmethod
+    @login_required
+    def matchmaking_stats(cls):
+        """Current grouper queue depth and median and p95 time-to-pair so far, aggregated from the barrier links (dashboard login)."""
+        from flask import jsonify
+        from psynet.sync import ParticipantLinkBarrier
+        from sqlalchemy import func
+        links = ParticipantLinkBarrier.query.filter_by(barrier_id="sig_space_groups_grouper")
+        # waiting as psynet's grouper counts it: not released, and still working
+        queue_depth = (
+            links.join(Participant)
+            .filter(~ParticipantLinkBarrier.released, ~Participant.failed, Participant.status == "working")
+            .count()
+        )
+        wait = func.extract("epoch", ParticipantLinkBarrier.departure_time - ParticipantLinkBarrier.arrival_time)
+        n, median, p95 = (
+            links.filter(ParticipantLinkBarrier.released, ParticipantLinkBarrier.arrival_time.isnot(None))
+            .with_entities(
+                func.count(),
+                func.percentile_cont(0.5).within_group(wait),
+                func.percentile_cont(0.95).within_group(wait),
+            )
+            .one()
+        )
+        return jsonify({
+            "queue_depth": queue_depth,
+            "time_to_pair_seconds": {"n": n, "median": median, "p95": p95},
+        })
+
+    @experiment_route("/barrier_index_stats", methods=["GET"])
+    @classmethod
+    def barrier_index_stats(cls):
+        """Barrier-membership lookups served from memory vs. the database, for this web process."""
+        from flask import jsonify
+        return jsonify(barrier_index.stats())
+
+    @experiment_route(AUDIO_ROUTE + "/<rhythm>", methods=["GET"])
+    @classmethod
+    def rhythm_audio(cls, rhythm):
+        """Stream a rendered rhythm from memory, with range requests and a strong ETag; 404 unless a stimulus uses its grid and kit."""
+        from flask import Response, abort, request
+        try:
+            key, data = render_service.result(rhythm)
+        except (KeyError, ValueError):
+            abort(404)
+        response = Response(data, mimetype=OUTPUT_FORMAT.mimetype)
+        response.set_etag(key)
+        response.cache_control.public = True
+        response.cache_control.no_cache = True  # always revalidate; a matching ETag costs a 304 and no body
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+    @experiment_route("/audio_metrics", methods=["GET"])
+    @classmethod
+    def audio_metrics(cls):
+        """Render-stage timings, sizes and cache hit rates of this web process; ?format=prometheus for text."""
+        from flask import Response, jsonify, request
+        if request.args.get("format") == "prometheus":
+            return Response(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+        return jsonify(metrics.snapshot())
 
     timeline = Timeline(
         CustomConsent(),
@@ -1,121 +1,854 @@
+import bisect
+import collections
+import concurrent.futures
+import configparser
+import contextlib
+import fcntl
+import functools
+import hashlib
+import importlib
+import io
+import json
+import logging
+import math
+import multiprocessing
 import os
+import tempfile
+import threading
+import time
 import numpy as np
-#from scipy.io import wavfile
-import audioread
-import re
-import librosa
-import soundfile as sf
+# soundfile, scipy and librosa are imported on first use through audio_engine, so
+# processes that never render (clock, psynet CLI) don't pay for them
+
+# not config.txt, whose sections Dallinger validates against its registered keys
+CONFIG_PATH = 'audio_config.txt'
+
+
+def audio_setting(key, default, cast=str):
+    """Read a per-deployment setting from the [Audio] section of audio_config.txt."""
+    parser = configparser.ConfigParser()
+    parser.read(CONFIG_PATH)
+    if parser.has_option('Audio', key):
+        return cast(parser.get('Audio', key))
+    return default
 
-from psynet.asset import S3Storage
-#asset_storage = S3Storage("sigspace-bucket", "sigspace-experiment")  # Comment out S3 for local development
 
 # Constants
-SAMPLE_RATE = 22050
+# Render rate for mixing and output; drums are resampled to it once (see SampleBank)
+SAMPLE_RATE = audio_setting('sample_rate', 22050, int)
 BASE_STEPS = 16  # matches drum_machine.html internal resolution
 STEP_TIME = 0.125  # 125ms per 16th note (120 BPM) - matches drum_machine.html STEP_TIME
 
+
+DRUMS = ('hihat', 'snare', 'kick')
+KIT_DRUMS = {
+    'snare+kick': ('snare', 'kick'),
+    'hihat+snare+kick': ('hihat', 'snare', 'kick'),
+    'kick': ('kick',),
+}
+KIT_BY_DRUMS = {drums: kit_type for kit_type, drums in KIT_DRUMS.items()}
+
+# Written by `python -m generate_sounds prerender` and shipped with the deployment;
+# requests only read it
+RENDER_BANK_DIR = 'static/render_bank'
+SAMPLE_CACHE_DIR = f'{RENDER_BANK_DIR}/samples'
+# Matcher playback loops the rhythm: wrap sample tails into the start of the cycle and
+# put several cycles in each file (see add_sample and loop_cycles)
+SEAMLESS_LOOP = audio_setting('seamless_loop', 'true').lower() == 'true'
+LOOP_REPETITIONS = audio_setting('loop_repetitions', 2, int)
+
+MAX_PRECOMPUTED_PATTERNS = 4096  # covers the 4-step grids; the 8-step spaces are rendered on demand
+
+
+audio_log = logging.getLogger('generate_sounds')
+
+# Histogram bucket upper bounds, Prometheus style (an implicit +Inf bucket follows)
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)  # seconds
+SIZE_BUCKETS = tuple(2 ** n for n in range(10, 26, 2))  # 1 KiB .. 32 MiB
+
+
+class Histogram:
+    """Fixed-bucket histogram of observed values."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (None if empty or past the last bound)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+    def cumulative(self):
+        """(bound, observations <= bound) pairs, ending with ('+Inf', count)."""
+        running = 0
+        pairs = []
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+
+class RenderMetrics:
+    """
+    In-process record of how long each render stage takes, how many bytes it handles, and
+    how often each cache hits.
+
+    Every observation also goes out as a JSON log line on the ``generate_sounds`` logger (at
+    DEBUG, so it costs nothing unless enabled). Render pool workers set ``forward`` and hand
+    their observations back to the web process with each result (see RenderService).
+    """
+
+    def __init__(self):
+        self.forward = False
+        self._durations = collections.defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self._sizes = collections.defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self._cache = collections.Counter()
+        self._forwarded = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        """Time the block as stage ``name``; set ``info['bytes']`` inside it to record a size."""
+        info = {}
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.observe(name, time.perf_counter() - start, info.get('bytes'), **fields)
+
+    def observe(self, stage, seconds, nbytes=None, **fields):
+        self._record(('stage', stage, seconds, nbytes))
+        if audio_log.isEnabledFor(logging.DEBUG):
+            audio_log.debug(json.dumps({'event': 'audio_stage', 'stage': stage, 'ms': round(seconds * 1e3, 3), 'bytes': nbytes, **fields}))
+
+    def cache_event(self, cache, hit):
+        self._record(('cache', cache, hit))
+
+    def _record(self, observation):
+        with self._lock:
+            if observation[0] == 'stage':
+                _, stage, seconds, nbytes = observation
+                self._durations[stage].observe(seconds)
+                if nbytes is not None:
+                    self._sizes[stage].observe(nbytes)
+            else:
+                _, cache, hit = observation
+                self._cache[cache, 'hit' if hit else 'miss'] += 1
+            if self.forward:
+                self._forwarded.append(observation)
+
+    def take_forwarded(self):
+        with self._lock:
+            forwarded, self._forwarded = self._forwarded, []
+        return forwarded
+
+    def merge(self, observations):
+        for observation in observations:
+            self._record(observation)
+
+    def snapshot(self):
+        """JSON-friendly summary: per-stage latency (ms) and bytes, and per-cache hit rates."""
+        def ms(value):
+            return None if value is None else value * 1e3
+
+        with self._lock:
+            stages = {}
+            for stage, histogram in sorted(self._durations.items()):
+                stages[stage] = {
+                    'count': histogram.count,
+                    'total_ms': histogram.sum * 1e3,
+                    'p50_ms_le': ms(histogram.quantile(0.5)),
+                    'p95_ms_le': ms(histogram.quantile(0.95)),
+                }
+                sizes = self._sizes.get(stage)
+                if sizes is not None:
+                    stages[stage]['bytes'] = sizes.sum
+                    stages[stage]['mean_bytes'] = sizes.sum / sizes.count
+            caches = {}
+            for (cache, result), count in sorted(self._cache.items()):
+                caches.setdefault(cache, {'hit': 0, 'miss': 0})[result] = count
+            for counts in caches.values():
+                counts['hit_rate'] = counts['hit'] / (counts['hit'] + counts['miss'])
+        return {'pid': os.getpid(), 'stages': stages, 'caches': caches}
+
+    def prometheus(self):
+        """The same data in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for metric, histograms in (('audio_stage_duration_seconds', self._durations), ('audio_stage_bytes', self._sizes)):
+                lines.append(f"# TYPE {metric} histogram")
+                for stage, histogram in sorted(histograms.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                    lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+            lines.append("# TYPE audio_cache_requests_total counter")
+            for (cache, result), count in sorted(self._cache.items()):
+                lines.append(f'audio_cache_requests_total{{cache="{cache}",result="{result}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+# Per process; the /audio_metrics experiment route exposes it
+metrics = RenderMetrics()
+
+
+class AudioEngine:
+    """The audio libraries this module needs, imported the first time they are used."""
+
+    @functools.cached_property
+    def soundfile(self):
+        return importlib.import_module('soundfile')
+
+    @functools.cached_property
+    def signal(self):
+        return importlib.import_module('scipy.signal')
+
+    def decode(self, path, sample_rate):
+        """Decode an audio file to mono float32 at ``sample_rate``.
+
+        libsndfile reads MP3 directly, which skips librosa's import and its audioread
+        fallback; librosa is only used if the installed libsndfile can't open the file.
+        """
+        try:
+            data, rate = self.soundfile.read(path, dtype='float32', always_2d=True)
+        except self.soundfile.LibsndfileError:
+            librosa = importlib.import_module('librosa')
+            data, _ = librosa.load(path, sr=sample_rate)
+            return np.asarray(data, dtype=np.float32)
+        data = data.mean(axis=1) if data.shape[1] > 1 else data[:, 0]
+        return self.resample(data, rate, sample_rate)
+
+    def resample(self, audio, rate, target_rate):
+        if rate == target_rate:
+            return audio
+        divisor = math.gcd(rate, target_rate)
+        return self.signal.resample_poly(audio, target_rate // divisor, rate // divisor).astype(audio.dtype)
+
+    def write(self, file, audio, rate, format, subtype=None):
+        self.soundfile.write(file, audio, rate, format=format, subtype=subtype)
+
+
+audio_engine = AudioEngine()
+
+
+class SampleBank:
+    """
+    Decoded drum samples, shared by every renderer and every worker process on a host.
+
+    The drums are decoded and resampled to ``sample_rate`` once per deployment and stored
+    as the rows of a single ``drums_<rate>hz.npy`` in ``cache_dir``. Each process maps that
+    file read-only, so the sample data lives once in the OS page cache.
+    """
+
+    def __init__(self, sample_dir='static/audio', sample_rate=SAMPLE_RATE, cache_dir=SAMPLE_CACHE_DIR, names=DRUMS):
+        self.sample_dir = sample_dir
+        self.sample_rate = sample_rate
+        self.cache_dir = cache_dir
+        self.names = tuple(names)
+        self.hits = 0
+        self.misses = 0
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache_path(self):
+        return os.path.join(self.cache_dir, f'drums_{self.sample_rate}hz.npy')
+
+    def get(self, name):
+        """Return the decoded sample as a read-only float32 array."""
+        sample = self._samples.get(name)
+        if sample is not None:
+            self.hits += 1
+            return sample
+        with self._lock:
+            # another thread may have mapped the samples while we were waiting for the lock
+            if not self._samples:
+                self.misses += 1
+                self._samples = self._map()
+            else:
+                self.hits += 1
+        return self._samples[name]
+
+    def _map(self):
+        sources = [f'{self.sample_dir}/{name}.mp3' for name in self.names]
+        table = None
+        try:
+            if os.path.getmtime(self.cache_path) >= max(os.path.getmtime(source) for source in sources):
+                table = np.load(self.cache_path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass  # not cached yet, or a partial file: decode again
+        hit = table is not None and table.shape[0] == len(self.names)
+        metrics.cache_event('sample_table', hit)
+        if not hit:
+            with metrics.stage('decode', drums=len(sources)):
+                self._write_table(sources)
+            table = np.load(self.cache_path, mmap_mode='r')
+        samples = {}
+        for name, row in zip(self.names, table.view(np.ndarray)):
+            # rows are zero-padded to the longest drum; trailing zeros add nothing to a mix
+            nonzero = np.flatnonzero(row)
+            samples[name] = row[:nonzero[-1] + 1 if len(nonzero) else 0]
+        return samples
+
+    def _write_table(self, sources):
+        decoded = [audio_engine.decode(source, self.sample_rate) for source in sources]
+        table = np.zeros((len(decoded), max(len(data) for data in decoded)), dtype=np.float32)
+        for row, data in zip(table, decoded):
+            row[:len(data)] = data
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, table)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates it owner-only
+        os.replace(tmp_path, self.cache_path)
+
+    def preload(self, names=DRUMS):
+        for name in names:
+            self.get(name)
+        return self
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'loaded': sorted(self._samples)}
+
+
+# Shared by every renderer in this module; each worker process maps the drums once
+sample_bank = SampleBank()
+
+
 def load_sample(filename):
-    data, sample_rate = librosa.load(f'static/audio/{filename}.mp3', sr=None)  # audioread.audio_open(f'static/audio/{filename}.mp3')
-    return data
+    return sample_bank.get(filename)
 
 def create_silence(duration):
     """Create a silent audio segment."""
     return np.zeros(int(duration * SAMPLE_RATE))
 
-def generate_pattern_audio(pattern, grid_size, kit_type):
-    """Generate audio for a specific pattern."""
-    # Load the base samples
-    hihat = load_sample('hihat')
-    snare = load_sample('snare')
-    kick = load_sample('kick')
-    
-    # Calculate timing based on grid size
-    factor = BASE_STEPS / grid_size  # How many 16th notes per grid step
-    beat_duration = STEP_TIME * factor  # Duration of each grid step
-    
-    # Calculate total duration
-    total_duration = grid_size * beat_duration
-    total_samples = int(total_duration * SAMPLE_RATE)
-    
-    # Calculate samples per beat
-    samples_per_beat = int(beat_duration * SAMPLE_RATE)
-    
-    # Create empty audio array
-    audio = np.zeros(total_samples)
-    
-    # Parse the pattern and determine which drums to use
-    patterns = {}  # Initialize patterns dictionary
-    
-    if kit_type == 'snare+kick':
-        snare_pattern, kick_pattern = pattern.split('_')
-        patterns = {'snare': snare_pattern, 'kick': kick_pattern}
-    elif kit_type == 'hihat+snare+kick':
-        hihat_pattern, snare_pattern, kick_pattern = pattern.split('_')
-        patterns = {'hihat': hihat_pattern, 'snare': snare_pattern, 'kick': kick_pattern}
-    elif kit_type == 'kick':
-        patterns = {'kick': pattern}
-    else:
-        # Fallback: try to parse the pattern as individual components
-        pattern_parts = pattern.split('_')
-        if len(pattern_parts) >= 2:
-            patterns = {'kick': pattern_parts[0], 'snare': pattern_parts[1]}
-        elif len(pattern_parts) == 1:
-            patterns = {'kick': pattern_parts[0]}
-        else:
-            raise ValueError(f"Invalid pattern format: {pattern}")
+class Pattern:
+    """
+    A drum-machine rhythm: one integer bitmask per drum row, plus grid size and kit.
+
+    Step 0 is the most significant bit of each row, so a row is ``int(steps, 2)``. Patterns
+    are immutable and hashable, and compare in O(1) through their combined ``code``.
+    """
+
+    __slots__ = ('kit_type', 'grid_size', 'rows', 'code', '_hash')
+
+    def __init__(self, kit_type, grid_size, rows):
+        drums = KIT_DRUMS.get(kit_type)
+        if drums is None:
+            raise ValueError(f"Unknown drum kit: {kit_type}")
+        if len(rows) != len(drums):
+            raise ValueError(f"{kit_type} needs {len(drums)} rows, got {len(rows)}")
+        code = 0
+        limit = 1 << grid_size
+        for row in rows:
+            if not 0 <= row < limit:
+                raise ValueError(f"Row {row} does not fit in {grid_size} steps")
+            code = (code << grid_size) | row
+        self.kit_type = kit_type
+        self.grid_size = grid_size
+        self.rows = tuple(rows)
+        self.code = code  # all rows concatenated, first drum in the most significant bits
+        self._hash = hash((kit_type, grid_size, code))
+
+    @classmethod
+    def from_code(cls, code, grid_size, kit_type):
+        mask = (1 << grid_size) - 1
+        n_rows = len(KIT_DRUMS[kit_type])
+        return cls(kit_type, grid_size, [(code >> (grid_size * (n_rows - 1 - i))) & mask for i in range(n_rows)])
+
+    @classmethod
+    def from_string(cls, director_sound_str):
+        """
+        Parse a drum-machine answer like 'hihat_1100_snare_0000_kick_0000'.
+
+        The trailing underscore the drum machine adds is ignored; the kit follows from the drums present.
+        """
+        tokens = director_sound_str.rstrip('_').split('_')
+        kit_type = KIT_BY_DRUMS.get(tuple(tokens[::2]))
+        if kit_type is None or len(tokens) % 2:
+            raise ValueError(f"No valid patterns found in the input string: {director_sound_str}")
+        return cls._from_rows(kit_type, tokens[1::2], director_sound_str)
+
+    @classmethod
+    def from_kit_pattern(cls, pattern, grid_size, kit_type):
+        """Parse the kit format used for file names and the render bank, e.g. '1100_0000_0000'."""
+        rows = pattern.split('_')
+        if len(rows) != len(KIT_DRUMS.get(kit_type, ())):
+            raise ValueError(f"Invalid pattern format for {kit_type}: {pattern}")
+        pattern = cls._from_rows(kit_type, rows, pattern)
+        if pattern.grid_size != grid_size:
+            raise ValueError(f"Expected {grid_size} steps per row: {pattern.kit_pattern()}")
+        return pattern
+
+    @classmethod
+    def _from_rows(cls, kit_type, rows, source):
+        grid_size = len(rows[0])
+        try:
+            bitmasks = [int(row, 2) for row in rows if len(row) == grid_size]
+        except ValueError:
+            raise ValueError(f"Invalid pattern format for {kit_type}: {source}") from None
+        if len(bitmasks) != len(rows):
+            raise ValueError(f"Drum rows have different lengths: {source}")
+        return cls(kit_type, grid_size, bitmasks)
+
+    def row_steps(self, i):
+        return format(self.rows[i], f'0{self.grid_size}b')
+
+    def kit_pattern(self):
+        """'1100_0000_0000' form, one block of steps per drum in kit order."""
+        return '_'.join(self.row_steps(i) for i in range(len(self.rows)))
+
+    def to_string(self):
+        """Drum-machine form, e.g. 'hihat_1100_snare_0000_kick_0000'."""
+        return '_'.join(f'{drum}_{self.row_steps(i)}' for i, drum in enumerate(KIT_DRUMS[self.kit_type]))
+
+    def hit_steps(self):
+        """(n_drums, grid_size) boolean array of the steps switched on."""
+        shifts = np.arange(self.grid_size - 1, -1, -1)
+        return (np.array(self.rows, dtype=np.int64)[:, None] >> shifts) & 1 == 1
+
+    def __eq__(self, other):
+        if other.__class__ is not Pattern:
+            return NotImplemented
+        return self.code == other.code and self.grid_size == other.grid_size and self.kit_type == other.kit_type
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        # rebuild on unpickle: _hash depends on the process's string hash seed
+        return Pattern, (self.kit_type, self.grid_size, self.rows)
+
+    def __repr__(self):
+        return f"Pattern.from_string({self.to_string()!r})"
+
+
+def step_positions(grid_size):
+    """Sample offset of each grid step."""
+    # onsets are placed in SAMPLE_RATE samples, so the drums must be decoded at that rate
+    assert sample_bank.sample_rate == SAMPLE_RATE, f"samples at {sample_bank.sample_rate} Hz, rendering at {SAMPLE_RATE} Hz"
+    beat_duration = STEP_TIME * BASE_STEPS / grid_size  # Duration of each grid step
+    return (np.arange(grid_size) * beat_duration * SAMPLE_RATE).astype(np.int64)
+
+
+def pattern_onsets(pattern):
+    """Map each drum in the pattern to the sample offsets of its hits."""
+    positions = step_positions(pattern.grid_size)
+    return {drum: positions[hits] for drum, hits in zip(KIT_DRUMS[pattern.kit_type], pattern.hit_steps())}
+
+
+def add_sample(buffer, sample, pos):
+    """
+    Add a drum sample into a one-cycle buffer at ``pos``.
+
+    With SEAMLESS_LOOP the part of the sample that runs past the end of the cycle wraps
+    around to the start, where it would sound when the rhythm loops; otherwise it is cut off.
+    """
+    total_samples = len(buffer)
+    end_pos = min(pos + len(sample), total_samples)
+    buffer[pos:end_pos] += sample[:end_pos - pos]
+    done = end_pos - pos
+    while SEAMLESS_LOOP and done < len(sample):
+        n = min(len(sample) - done, total_samples)
+        buffer[:n] += sample[done:done + n]
+        done += n
+
+
+def mix_onsets(onsets, total_samples):
+    """
+    Mix drum hits given as onset-index arrays into a single float32 buffer.
+
+    Each hit is one slice-add of its whole sample, so the work is proportional to the
+    samples actually written. A single ``np.bincount`` scatter-add over all hits was
+    measured too (see benchmarks/mixing.py) and is several times slower: it has to
+    materialise an int64 index for every sample it adds.
+    """
+    audio = np.zeros(total_samples, dtype=np.float32)
+    for drum, positions in onsets.items():
+        sample = sample_bank.get(drum)
+        for pos in positions.tolist():
+            add_sample(audio, sample, pos)
+    return audio
+
+
+def loop_cycles(audio, repetitions=None):
+    """Repeat one rendered cycle (or a batch of cycles, along the last axis) into a pre-looped asset."""
+    repetitions = LOOP_REPETITIONS if repetitions is None else repetitions
+    if repetitions == 1:
+        return audio
+    return np.tile(audio, (1,) * (audio.ndim - 1) + (repetitions,))
+
+
+def generate_pattern_audio(pattern, repetitions=None):
+    """
+    Generate audio for a specific pattern.
+
+    The result holds ``repetitions`` cycles of the rhythm (LOOP_REPETITIONS by default),
+    so the matcher page's <audio loop> restarts the decoder only once every few cycles.
+    """
+    # Every grid covers BASE_STEPS 16th notes, so the total duration doesn't depend on grid size
+    total_samples = int(BASE_STEPS * STEP_TIME * SAMPLE_RATE)
+
+    with metrics.stage('mix', grid_size=pattern.grid_size, kit=pattern.kit_type):
+        audio = mix_onsets(pattern_onsets(pattern), total_samples)
 
-    
-    # Add each beat to the audio
-    for i in range(grid_size):
-        # Calculate position in the audio array
-        pos = int(i * beat_duration * SAMPLE_RATE)
-
-        # Add each drum hit with full sample length
-        if 'hihat' in patterns and i < len(patterns['hihat']) and patterns['hihat'][i] == '1':
-            # Add hihat sample, but don't exceed the audio array bounds
-            end_pos = min(pos + len(hihat), len(audio))
-            audio[pos:end_pos] += hihat[:end_pos - pos]
-            
-        if 'snare' in patterns and i < len(patterns['snare']) and patterns['snare'][i] == '1':
-            # Add snare sample, but don't exceed the audio array bounds
-            end_pos = min(pos + len(snare), len(audio))
-            audio[pos:end_pos] += snare[:end_pos - pos]
-            
-        if 'kick' in patterns and i < len(patterns['kick']) and patterns['kick'][i] == '1':
-            # Add kick sample, but don't exceed the audio array bounds
-            end_pos = min(pos + len(kick), len(audio))
-            audio[pos:end_pos] += kick[:end_pos - pos]
-    
     # Normalize audio
-    if np.max(np.abs(audio)) > 0:
-        audio = audio / np.max(np.abs(audio))
-    
+    with metrics.stage('normalize'):
+        peak = np.max(np.abs(audio))
+        if peak > 0:
+            audio = audio / peak
+        audio = loop_cycles(audio, repetitions)
+
+    return audio
+
+_step_templates = {}
+
+
+def step_templates(grid_size, kit_type):
+    """
+    Matrix with one row per (drum, grid step): the drum sample placed at that step's onset.
+
+    Rows are ordered like the drum rows of a kit pattern, so a pattern's flattened 0/1 steps
+    times this matrix is its unnormalised mix.
+    """
+    templates = _step_templates.get((grid_size, kit_type))
+    if templates is None:
+        total_samples = int(BASE_STEPS * STEP_TIME * SAMPLE_RATE)
+        positions = step_positions(grid_size)
+        drums = KIT_DRUMS[kit_type]
+        templates = np.zeros((len(drums) * grid_size, total_samples), dtype=np.float32)
+        for d, drum in enumerate(drums):
+            sample = sample_bank.get(drum)
+            for i, pos in enumerate(positions.tolist()):
+                add_sample(templates[d * grid_size + i], sample, pos)
+        templates.flags.writeable = False
+        templates = _step_templates.setdefault((grid_size, kit_type), templates)
+    return templates
+
+
+def onset_matrix(patterns, grid_size, kit_type):
+    """Binary (n_patterns, n_drums * grid_size) matrix of the steps switched on in each pattern."""
+    if any(p.grid_size != grid_size or p.kit_type != kit_type for p in patterns):
+        raise ValueError(f"Every pattern in a batch must be a {grid_size}-step {kit_type} pattern")
+    width = len(KIT_DRUMS[kit_type]) * grid_size
+    codes = np.fromiter((p.code for p in patterns), dtype=np.int64, count=len(patterns))
+    shifts = np.arange(width - 1, -1, -1)
+    return ((codes[:, None] >> shifts) & 1).astype(np.float32)
+
+
+def render_batch(patterns, grid_size, kit_type):
+    """
+    Render many Patterns of the same grid size and kit in one matrix multiplication.
+
+    Returns a float32 array of shape (n_patterns, n_samples) holding one cycle per pattern,
+    normalised like ``generate_pattern_audio``; ``loop_cycles`` repeats it. Memory grows with the batch, so use ``iter_render_batch``
+    for large pattern lists.
+    """
+    audio = onset_matrix(patterns, grid_size, kit_type) @ step_templates(grid_size, kit_type)
+    peaks = np.max(np.abs(audio), axis=1, keepdims=True)
+    np.divide(audio, peaks, out=audio, where=peaks > 0)
     return audio
 
+
+def iter_render_batch(patterns, grid_size, kit_type, chunk_size=256):
+    """Yield ``(chunk_patterns, audio)`` pairs from ``render_batch`` so memory stays bounded."""
+    chunk = []
+    for pattern in patterns:
+        chunk.append(pattern)
+        if len(chunk) == chunk_size:
+            yield chunk, render_batch(chunk, grid_size, kit_type)
+            chunk = []
+    if chunk:
+        yield chunk, render_batch(chunk, grid_size, kit_type)
+
+
+class AudioFormat:
+    """An output encoding for rendered rhythms."""
+
+    def __init__(self, name, extension, mimetype, sf_format, subtype=None, sample_rates=None):
+        self.name = name
+        self.extension = extension
+        self.mimetype = mimetype
+        self.sf_format = sf_format
+        self.subtype = subtype
+        self.sample_rates = sample_rates  # None if the encoder accepts any rate
+
+    def output_rate(self, sample_rate):
+        if self.sample_rates is None or sample_rate in self.sample_rates:
+            return sample_rate
+        return min((rate for rate in self.sample_rates if rate >= sample_rate), default=max(self.sample_rates))
+
+    def encode(self, audio, sample_rate=SAMPLE_RATE):
+        rate = self.output_rate(sample_rate)
+        audio = audio_engine.resample(audio, sample_rate, rate)
+        buffer = io.BytesIO()
+        audio_engine.write(buffer, audio, rate, self.sf_format, self.subtype)
+        return buffer.getvalue()
+
+
+AUDIO_FORMATS = {
+    'mp3': AudioFormat('mp3', 'mp3', 'audio/mpeg', 'MP3'),
+    # lossless and without encoder padding, so <audio loop> is gapless
+    'wav': AudioFormat('wav', 'wav', 'audio/wav', 'WAV', 'PCM_16'),
+    'flac': AudioFormat('flac', 'flac', 'audio/flac', 'FLAC', 'PCM_16'),
+    # Opus only encodes at 8/12/16/24/48 kHz, so renders are resampled up to the next of those
+    'opus': AudioFormat('opus', 'ogg', 'audio/ogg', 'OGG', 'OPUS', sample_rates=(8000, 12000, 16000, 24000, 48000)),
+}
+
+# Chosen per deployment with `audio_format` in audio_config.txt
+OUTPUT_FORMAT = AUDIO_FORMATS[audio_setting('audio_format', 'mp3').lower()]
+
+# Everything besides the pattern that changes the encoded bytes; part of every cache key
+RENDER_SETTINGS = f"{SAMPLE_RATE}hz_{OUTPUT_FORMAT.name}_{'loop' if SEAMLESS_LOOP else 'cut'}x{LOOP_REPETITIONS}"
+
+
+def encode_audio(audio, audio_format=None):
+    """Encode rendered audio to bytes in the deployment's output format."""
+    audio_format = audio_format or OUTPUT_FORMAT
+    with metrics.stage('encode', format=audio_format.name) as info:
+        data = audio_format.encode(audio, SAMPLE_RATE)
+        info['bytes'] = len(data)
+    return data
+
+
+def kit_pattern_space(grid_size, kit_type):
+    """Every Pattern a drum machine with this grid size and kit can produce."""
+    for code in range(2 ** (grid_size * len(KIT_DRUMS[kit_type]))):
+        yield Pattern.from_code(code, grid_size, kit_type)
+
+
+class RenderBank:
+    """
+    Packed on-disk store of encoded renders for one (grid size, kit) pattern space.
+
+    Renders are appended to a single ``.bin`` file; the ``.idx`` file next to it is the
+    manifest, with one ``code offset length sha256`` line per render, where code is
+    ``Pattern.code``. Both files are append-only and only the offline build writes them;
+    readers map the ``.bin`` read-only, sharing its pages with every other process on the
+    host. A render is checked against its hash the first time a process reads it, and
+    ``verify`` checks the whole bank.
+    """
+
+    def __init__(self, grid_size, kit_type, bank_dir=RENDER_BANK_DIR):
+        self.grid_size = grid_size
+        self.kit_type = kit_type
+        stem = os.path.join(bank_dir, f"grid{grid_size}_{kit_type}_{RENDER_SETTINGS}")
+        self.data_path = f"{stem}.bin"
+        self.index_path = f"{stem}.idx"
+        self.hits = 0
+        self.misses = 0
+        self._index = {}
+        self._index_size = 0
+        self._verified = set()
+        self._mapped = None
+        self._lock = threading.Lock()
+
+    @property
+    def space_size(self):
+        return 2 ** (self.grid_size * len(KIT_DRUMS[self.kit_type]))
+
+    def _refresh_index(self):
+        # Pick up renders appended by other processes since we last looked
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            return
+        if size == self._index_size:
+            return
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_size)
+            chunk = f.read(size - self._index_size)
+        # only consume complete lines; a concurrent writer may be mid-append
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        for line in complete.decode().splitlines():
+            code, offset, length, digest = line.split()
+            self._index[int(code)] = (int(offset), int(length), digest)
+        self._index_size += len(complete)
+
+    def get(self, pattern):
+        """Return the encoded render for ``pattern``, or None if it is not in the bank."""
+        with self._lock:
+            entry = self._index.get(pattern.code)
+            if entry is None:
+                self._refresh_index()
+                entry = self._index.get(pattern.code)
+        data = None
+        if entry is not None:
+            offset, length, digest = entry
+            with metrics.stage('bank_read') as info:
+                data = self._data(offset + length)[offset:offset + length].tobytes()
+                info['bytes'] = length
+            if pattern.code not in self._verified:
+                if hashlib.sha256(data).hexdigest() != digest:
+                    audio_log.warning(f"{pattern.to_string()} does not match its hash in {self.index_path}; rendering it on demand")
+                    data = None
+                else:
+                    self._verified.add(pattern.code)
+        metrics.cache_event('render_bank', data is not None)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def verify(self):
+        """Check every render in the bank against its hash; return the codes of those that differ."""
+        with self._lock:
+            self._refresh_index()
+            entries = dict(self._index)
+        if not entries:
+            return []
+        data = self._data(max(offset + length for offset, length, _ in entries.values()))
+        return sorted(
+            code for code, (offset, length, digest) in entries.items()
+            if hashlib.sha256(data[offset:offset + length]).hexdigest() != digest
+        )
+
+    def _data(self, end):
+        # map the blob read-only, remapping when renders appended since cover ``end``
+        data = self._mapped
+        if data is None or len(data) < end:
+            data = self._mapped = np.memmap(self.data_path, dtype=np.uint8, mode='r')
+        return data
+
+    def put(self, pattern, data):
+        """Append an encoded render to the bank."""
+        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+        with metrics.stage('bank_write') as info, self._lock, open(self.index_path, 'ab') as index_file:
+            info['bytes'] = len(data)
+            # the index lock serialises writers across processes, so offsets never interleave
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                with open(self.data_path, 'ab') as data_file:
+                    offset = data_file.tell()
+                    if offset == 0:
+                        # a new bank: readable by every process whatever the builder's umask
+                        os.fchmod(data_file.fileno(), 0o644)
+                        os.fchmod(index_file.fileno(), 0o644)
+                    data_file.write(data)
+                digest = hashlib.sha256(data).hexdigest()
+                index_file.write(f"{pattern.code} {offset} {len(data)} {digest}\n".encode())
+            finally:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+            self._index[pattern.code] = (offset, len(data), digest)
+            self._verified.add(pattern.code)
+
+    def __contains__(self, pattern):
+        with self._lock:
+            self._refresh_index()
+            return pattern.code in self._index
+
+
+_render_banks = {}
+
+
+def get_render_bank(grid_size, kit_type):
+    bank = _render_banks.get((grid_size, kit_type))
+    if bank is None:
+        bank = _render_banks.setdefault((grid_size, kit_type), RenderBank(grid_size, kit_type))
+    return bank
+
+
+def render_pattern_bytes(pattern):
+    """
+    Encoded audio for a pattern: a bank lookup when the pattern was prerendered, otherwise
+    an on-demand render. Requests never write to the bank, so its size is fixed by what
+    was built before deployment.
+    """
+    start = time.perf_counter()
+    data = get_render_bank(pattern.grid_size, pattern.kit_type).get(pattern)
+    source = 'render_bank'
+    if data is None:
+        data = encode_audio(generate_pattern_audio(pattern))
+        source = 'render'
+    seconds = time.perf_counter() - start
+    metrics.observe('render_pattern', seconds, len(data), source=source)
+    audio_log.info(json.dumps({
+        'event': 'audio_render', 'rhythm': pattern.to_string(), 'source': source,
+        'ms': round(seconds * 1e3, 3), 'bytes': len(data),
+    }))
+    return data
+
+
+def node_spaces(nodes):
+    """The (grid size, kit) pattern spaces a list of stimulus nodes uses."""
+    return frozenset((node.definition["grid_size"], node.definition["drum_kit"]) for node in nodes)
+
+
+@functools.cache
+def stimulus_spaces():
+    """The spaces of ``node_creation.get_nodes`` and ``get_testing_nodes``, read from the nodes themselves."""
+    # relative inside the experiment package, absolute when run as `python -m generate_sounds`
+    node_creation = importlib.import_module('.node_creation', __package__) if __package__ else importlib.import_module('node_creation')
+    return node_spaces(node_creation.get_nodes() + node_creation.get_testing_nodes())
+
+
+def stimulus_pattern(director_sound_str):
+    """Parse a rhythm to play back; ValueError unless it is from one of the ``stimulus_spaces``."""
+    pattern = Pattern.from_string(director_sound_str)
+    if (pattern.grid_size, pattern.kit_type) not in stimulus_spaces():
+        raise ValueError(f"No stimulus uses {pattern.grid_size}-step {pattern.kit_type} rhythms: {director_sound_str}")
+    return pattern
+
+
+def audio_cache_key(pattern):
+    """
+    Content address of a render: a hash of the canonical (kit, grid, pattern) plus the
+    render settings, so a settings change never serves a stale file.
+    """
+    canonical = f"{pattern.kit_type}|{pattern.grid_size}|{pattern.kit_pattern()}|{RENDER_SETTINGS}"
+    return hashlib.sha256(canonical.encode()).hexdigest()[:24]
+
+
+# Hits and misses of generate_audio_file's content-addressed files
+audio_file_counts = collections.Counter()
+
+
+def audio_file_hit_rate():
+    total = audio_file_counts['hits'] + audio_file_counts['misses']
+    return audio_file_counts['hits'] / total if total else 0.0
+
+
 def generate_audio_file(pattern, grid_size, kit_type, output_dir='static/generated_sounds'):
-    """Generate a single audio file from a rhythm pattern."""
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Generate the audio
-    audio = generate_pattern_audio(pattern, grid_size, kit_type)
-
-    # Create filename based on kit type
-    if kit_type == 'snare+kick':
-        snare_pattern, kick_pattern  = pattern.split('_')
-        filename = f"grid{grid_size}_snare{snare_pattern}_kick{kick_pattern}.mp3"
-    elif kit_type == 'hihat+snare+kick':
-        hihat_pattern, snare_pattern, kick_pattern = pattern.split('_')
-        filename = f"grid{grid_size}_hihat{hihat_pattern}_snare{snare_pattern}_kick{kick_pattern}.mp3"
-    
-    # Full path for the file
+    """Generate a single audio file from a kit pattern like '1100_0000_0000', reusing the cached file if it exists."""
+    if not isinstance(pattern, Pattern):
+        pattern = Pattern.from_kit_pattern(pattern, grid_size, kit_type)
+    filename = f"{audio_cache_key(pattern)}.{OUTPUT_FORMAT.extension}"
     full_path = os.path.join(output_dir, filename)
+    hit = os.path.exists(full_path)
+    audio_file_counts['hits' if hit else 'misses'] += 1
+    metrics.cache_event('file', hit)
+    if not hit:
+        data = render_pattern_bytes(pattern)
+        os.makedirs(output_dir, exist_ok=True)
+        # Write to a temp file and rename, so other processes never serve a half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+        try:
+            with metrics.stage('file_write') as info:
+                info['bytes'] = len(data)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.chmod(tmp_path, 0o644)  # mkstemp creates it owner-only
+                os.replace(tmp_path, full_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
-    # Save the audio file
-    #wavfile.write(full_path, SAMPLE_RATE, (audio * 32767).astype(np.int16))
-    #print(f'Saved audio file to: {full_path}')
-    sf.write(full_path, audio, SAMPLE_RATE, format='MP3')
-    
     # Return the path relative to the static directory for web access
     return os.path.join('generated_sounds', filename)
 
@@ -130,34 +863,313 @@ def parse_and_generate_audio(director_sound_str):
     Returns:
         str: Path to the generated audio file
     """
+    pattern = Pattern.from_string(director_sound_str)
 
-    # Remove trailing underscore if present (drum machine outputs with trailing underscore)
-    if director_sound_str.endswith('_'):
-        director_sound_str = director_sound_str[:-1]
+    # Generate the audio file
+    return generate_audio_file(pattern, pattern.grid_size, pattern.kit_type)
 
-    # Extract patterns
-    patterns = {}
-    for drum in ['hihat', 'snare', 'kick']:
-        pattern_match = re.search(f'{drum}_([01]+)', director_sound_str)
-        if pattern_match:
-            patterns[drum] = pattern_match.group(1)
 
-    # Determine grid size from the first pattern
-    if not patterns:
-        raise ValueError("No valid patterns found in the input string")
-    
-    grid_size = len(next(iter(patterns.values())))
-
-    # Determine kit type based on which patterns are present
-    if 'hihat' in patterns:
-        kit_type = 'hihat+snare+kick'
-        pattern = f"{patterns['hihat']}_{patterns['snare']}_{patterns['kick']}"
-    elif 'snare' in patterns:
-        kit_type = 'snare+kick'
-        pattern = f"{patterns['snare']}_{patterns['kick']}"
-    else:
-        kit_type = 'kick'
-        pattern = patterns['kick']
-    
-    # Generate the audio file
-    return generate_audio_file(pattern, grid_size, kit_type)
+class AudioByteCache:
+    """Process-local LRU of encoded renders, bounded by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+        metrics.cache_event('memory', data is not None)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'items': len(self._items), 'bytes': self._size}
+
+
+audio_byte_cache = AudioByteCache(audio_setting('memory_cache_max_bytes', 64 * 1024 ** 2, int))
+
+
+class SharedAudioStore:
+    """
+    Encoded renders shared by every process of the deployment, in Dallinger's redis.
+
+    Background renders run where the barrier releases the pair (the clock process), while
+    the matcher's request reaches a web process; the render is published here under its
+    ``audio_cache_key`` so that process can stream it instead of rendering it again.
+    Entries expire after ``ttl`` seconds. Without redis every lookup is a miss.
+    """
+
+    PREFIX = 'rhythm_audio:'
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    @functools.cached_property
+    def _redis(self):
+        try:
+            from dallinger.db import redis_conn
+        except ImportError:
+            return None
+        return redis_conn
+
+    def get(self, key):
+        data = None
+        if self._redis is not None:
+            try:
+                data = self._redis.get(self.PREFIX + key)
+            except Exception as e:
+                audio_log.warning(f"Shared audio lookup failed: {e}")
+        metrics.cache_event('shared', data is not None)
+        return data
+
+    def put(self, key, data):
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(self.PREFIX + key, data, ex=self.ttl)
+        except Exception as e:
+            audio_log.warning(f"Publishing a render failed: {e}")
+
+
+shared_audio_store = SharedAudioStore(audio_setting('shared_cache_ttl_seconds', 6 * 3600, int))
+
+AUDIO_ROUTE = '/rhythm_audio'
+
+
+def rhythm_audio(director_sound_str):
+    """
+    Encoded audio for a rhythm: from this process's memory, then from the renders other
+    processes published, and only then rendered here (and published in turn).
+
+    Returns:
+        tuple: (key, data) where key is the content address of the render (usable as a strong ETag)
+    """
+    with metrics.stage('serve') as info:
+        pattern = stimulus_pattern(director_sound_str)
+        key = audio_cache_key(pattern)
+        data = audio_byte_cache.get(key)
+        if data is None:
+            data = shared_audio_store.get(key)
+            if data is None:
+                data = render_pattern_bytes(pattern)
+                shared_audio_store.put(key, data)
+            audio_byte_cache.put(key, data)
+        info['bytes'] = len(data)
+    return key, data
+
+
+def rhythm_audio_url(director_sound_str):
+    """
+    URL of the experiment route that streams a rhythm from memory.
+
+    The URL carries the canonical rhythm itself rather than a cache key, so any web dyno can
+    render it on a miss without a shared disk.
+    """
+    return f"{AUDIO_ROUTE}/{stimulus_pattern(director_sound_str).to_string()}"
+
+
+def _init_render_worker():
+    # send this worker's observations back with each result instead of keeping them here
+    metrics.forward = True
+    # decode the drums once when the worker starts, not on its first job
+    sample_bank.preload()
+
+
+def _render_in_worker(pattern):
+    data = render_pattern_bytes(pattern)
+    return data, metrics.take_forwarded()
+
+
+class RenderService:
+    """
+    Renders rhythms on a process pool, off the request thread.
+
+    ``submit`` returns immediately with a future of ``(data, worker observations)``; when it
+    completes the audio lands in ``audio_byte_cache`` and ``shared_audio_store``, and the
+    observations in ``metrics``. ``result`` waits for a render pending in this process,
+    otherwise it goes through ``rhythm_audio``, which finds renders other processes submitted
+    in the shared store and renders inline only if the rhythm was never rendered.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self, replace=False):
+        # a forked web worker must not reuse its parent's pool, and a pool that lost a worker
+        # refuses every submit until it is replaced
+        if replace or self._executor is None or self._executor_pid != os.getpid():
+            if replace:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                # fork, so workers inherit this module however the experiment package was imported
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_render_worker,
+            )
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def submit(self, director_sound_str):
+        """Start rendering a rhythm in the background and return a future of its encoded bytes and metrics."""
+        pattern = stimulus_pattern(director_sound_str)
+        key = audio_cache_key(pattern)
+        data = audio_byte_cache.get(key)
+        if data is not None:
+            future = concurrent.futures.Future()
+            future.set_result((data, []))
+            return future
+
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            try:
+                future = self._get_executor().submit(_render_in_worker, pattern)
+            except concurrent.futures.BrokenExecutor as e:
+                audio_log.warning(f"Render pool is broken, starting a new one: {e}")
+                future = self._get_executor(replace=True).submit(_render_in_worker, pattern)
+            self._pending[key] = future
+        # outside the lock: the callback runs immediately if the render has already finished
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return future
+
+    def _finish(self, key, future):
+        if not future.cancelled() and future.exception() is None:
+            data, observations = future.result()
+            metrics.merge(observations)
+            audio_byte_cache.put(key, data)
+            shared_audio_store.put(key, data)
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def result(self, director_sound_str, timeout=30):
+        """(key, data) for a rhythm, waiting only if its render is still in flight."""
+        key = audio_cache_key(stimulus_pattern(director_sound_str))
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            try:
+                # how long the request thread waits on the pool is what the matcher feels
+                with metrics.stage('render_wait'):
+                    data, _ = future.result(timeout)
+                return key, data
+            except Exception as e:
+                audio_log.warning(f"Background render of {director_sound_str} failed, rendering inline: {e}")
+        return rhythm_audio(director_sound_str)
+
+    def shutdown(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+
+render_service = RenderService(audio_setting('render_workers', 2, int))
+
+
+def _prerender_chunk(patterns):
+    """Render and encode a chunk of one pattern space; runs in a prerender worker."""
+    audio = loop_cycles(render_batch(patterns, patterns[0].grid_size, patterns[0].kit_type))
+    encoded = [(pattern, encode_audio(row)) for pattern, row in zip(patterns, audio)]
+    metrics.take_forwarded()  # prerender reports its own throughput
+    return encoded
+
+
+def prerender(nodes=None, max_patterns=MAX_PRECOMPUTED_PATTERNS, workers=None, chunk_size=64):
+    """
+    Render every stimulus the node definitions can reference into the render banks, in parallel.
+
+    Spaces are the ``stimulus_spaces`` by default; spaces with more than ``max_patterns``
+    patterns (the 8-step grids) are too large to enumerate and stay on-demand. Patterns
+    already in a bank's manifest are skipped, so an interrupted run resumes where it stopped.
+    Workers only render; this process appends to the banks and their manifests.
+    """
+    spaces = stimulus_spaces() if nodes is None else node_spaces(nodes)
+
+    todo = []
+    for grid_size, kit_type in sorted(spaces):
+        bank = get_render_bank(grid_size, kit_type)
+        if bank.space_size > max_patterns:
+            print(f"Skipping grid {grid_size} {kit_type}: {bank.space_size} patterns, rendered on demand")
+            continue
+        missing = [p for p in kit_pattern_space(grid_size, kit_type) if p not in bank]
+        print(f"Grid {grid_size} {kit_type}: {bank.space_size - len(missing)} of {bank.space_size} already in {bank.data_path}")
+        todo.extend(missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size))
+
+    total = sum(len(chunk) for chunk in todo)
+    n_files = n_bytes = 0
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context('fork'),
+        initializer=_init_render_worker,
+    ) as executor:
+        futures = [executor.submit(_prerender_chunk, chunk) for chunk in todo]
+        for future in concurrent.futures.as_completed(futures):
+            for pattern, data in future.result():
+                get_render_bank(pattern.grid_size, pattern.kit_type).put(pattern, data)
+                n_files += 1
+                n_bytes += len(data)
+            elapsed = time.perf_counter() - start
+            print(f"\r{n_files}/{total} renders, {n_files / elapsed:.0f} renders/s", end='', flush=True)
+
+    elapsed = time.perf_counter() - start
+    if total:
+        print()
+    print(f"Prerendered {n_files} rhythms ({n_bytes / 1e6:.1f} MB) in {elapsed:.1f} s: "
+          f"{n_files / max(elapsed, 1e-9):.0f} renders/s, {n_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s")
+    return n_files
+
+
+def verify_render_banks(nodes=None):
+    """Check every render bank of the stimulus spaces against its manifest; return how many renders differ."""
+    spaces = stimulus_spaces() if nodes is None else node_spaces(nodes)
+    n_bad = 0
+    for grid_size, kit_type in sorted(spaces):
+        bank = get_render_bank(grid_size, kit_type)
+        if not os.path.exists(bank.index_path):
+            continue
+        bad = bank.verify()
+        n_bad += len(bad)
+        print(f"Grid {grid_size} {kit_type}: {len(bad)} renders in {bank.data_path} do not match their hashes"
+              + (f": codes {bad[:10]}" if bad else ""))
+    return n_bad
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m generate_sounds')
+    commands = parser.add_subparsers(dest='command', required=True)
+    prerender_parser = commands.add_parser('prerender', help="render every stimulus the nodes can reference into the render banks")
+    prerender_parser.add_argument('--max-patterns', type=int, default=MAX_PRECOMPUTED_PATTERNS)
+    prerender_parser.add_argument('--workers', type=int, default=None, help="default: all cores")
+    commands.add_parser('verify', help="check the render banks against the hashes in their manifests")
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        raise SystemExit(1 if verify_render_banks() else 0)
+    prerender(max_patterns=args.max_patterns, workers=args.workers)
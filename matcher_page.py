@@ -0,0 +1,94 @@
+"""
+HTML for the matcher's page, compiled once at import.
+
+Everything static (the audio player, the colour cubes with their HSL styles, the click
+script) is rendered up front; a request only joins the cubes in its shuffled order and
+fills in the audio URL. Grids are cached per shuffle order.
+"""
+import html
+from functools import lru_cache
+
+MAX_CACHED_ORDERS = 4096  # 9 colours have 362880 orders; keep the ones actually drawn
+
+AUDIO_PLAYER_TEMPLATE = """
+<div style='margin-bottom: 20px; text-align: center;'>
+    <audio id='rhythm-audio' autoplay loop style='display: none;'>
+        <source src='%(audio_url)s' type='%(mimetype)s'>
+        Your browser does not support the audio element.
+    </audio>
+    <script>
+        // Auto-play the audio when the page loads
+        window.addEventListener('load', function() {
+            var audio = document.getElementById('rhythm-audio');
+            // Ensure the audio loops seamlessly like the drum machine
+            audio.loop = true;
+            audio.volume = 1.0;
+            audio.play().catch(function(error) {
+                console.log('Audio playback failed:', error);
+            });
+        });
+
+        // Ensure audio continues playing even if interrupted
+        document.addEventListener('visibilitychange', function() {
+            var audio = document.getElementById('rhythm-audio');
+            if (!document.hidden && audio.paused) {
+                audio.play().catch(function(error) {
+                    console.log('Audio playback failed:', error);
+                });
+            }
+        });
+    </script>
+</div>
+"""
+
+CUBE_TEMPLATE = (
+    "<div class='color-cube' data-color='%(color)s' "
+    "style='background-color: hsl(%(h)s, %(s)s%%, %(l)s%%); "
+    "width: 60px; height: 60px; border-radius: 50%%; border: 1px solid black; cursor: pointer;'></div>"
+)
+
+GRID_OPEN = "<div id='color-grid' style='display: grid; grid-template-columns: repeat(3, 70px); gap: 5px; justify-content: center;'>"
+
+# clicking a cube clicks the hidden PushButtonControl button at the same position
+GRID_CLOSE = """</div>
+<script>
+document.querySelectorAll('.color-cube').forEach(function(el, idx) {
+    el.onclick = function() {
+        // Find the corresponding hidden button and click it
+        var btns = document.querySelectorAll('button');
+        btns[idx].click();
+    }
+});
+</script>
+"""
+
+COLOR_PROMPT = "<div style='text-align:center;'>Your partner produced this rhythm. What color were they referring to?</div><br>"
+
+
+def audio_player(audio_url, mimetype):
+    return AUDIO_PLAYER_TEMPLATE % {"audio_url": html.escape(audio_url), "mimetype": mimetype}
+
+
+class ColorGridTemplate:
+    """
+    The matcher's colour grid for one colour table (``{name: [h, s, l]}``).
+
+    ``hsl`` and ``cubes`` are computed once; ``grid(order)`` joins the cubes for a shuffle
+    order and remembers the result, and ``render`` adds the prompt and audio player.
+    """
+
+    def __init__(self, color_dict):
+        self.colors = tuple(color_dict)
+        self.hsl = {color: tuple(hsl) for color, hsl in color_dict.items()}
+        self.cubes = {
+            color: CUBE_TEMPLATE % {"color": html.escape(color), "h": h, "s": s, "l": l}
+            for color, (h, s, l) in self.hsl.items()
+        }
+        self.grid = lru_cache(maxsize=MAX_CACHED_ORDERS)(self._grid)
+
+    def _grid(self, order):
+        return GRID_OPEN + "".join(self.cubes[color] for color in order) + GRID_CLOSE
+
+    def render(self, order, audio_url, mimetype):
+        """Prompt HTML for the colours in ``order`` (any sequence of colour names)."""
+        return COLOR_PROMPT + audio_player(audio_url, mimetype) + self.grid(tuple(order))
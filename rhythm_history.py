@@ -0,0 +1,105 @@
+"""
+Per-pair rhythm history: one row per director attempt at a node.
+
+Replaces reading the director's rhythms out of the participant vars blob. The latest
+attempt of a pair at a node is one seek on the (pair, node, attempt) index, and the whole
+history can be streamed out as CSV without loading it into memory.
+"""
+import csv
+import io
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
+
+from psynet.data import SQLBase, SQLMixin, register_table
+
+EXPORT_BATCH_SIZE = 500
+EXPORT_COLUMNS = (
+    "id", "sync_group_id", "node_id", "attempt", "trial_id", "director_id", "matcher_id", "stimulus",
+    "grid_size", "drum_kit", "pattern_code", "audio_key", "matcher_choice", "creation_time", "answered_at",
+)
+
+
+@register_table
+class RhythmAttempt(SQLBase, SQLMixin):
+    """
+    A rhythm a director sent for a node, and the matcher's choice for it.
+
+    ``pattern_code`` is ``Pattern.code``, the drum rows' step bitmasks concatenated (use
+    ``Pattern.from_code(pattern_code, grid_size, drum_kit)``); ``audio_key`` is the content
+    address of its render. ``creation_time`` is when the director's answer was saved.
+    """
+
+    __tablename__ = "rhythm_attempt"
+    __table_args__ = (Index("ix_rhythm_attempt_pair_node", "sync_group_id", "node_id", "attempt"),)
+
+    sync_group_id = Column(Integer, ForeignKey("sync_group.id"))
+    node_id = Column(Integer, ForeignKey("node.id"))
+    attempt = Column(Integer)
+    trial_id = Column(Integer, ForeignKey("info.id"))
+    director_id = Column(Integer, ForeignKey("participant.id"))
+    matcher_id = Column(Integer, ForeignKey("participant.id"))
+    stimulus = Column(String)  # the node's color or melody
+    grid_size = Column(Integer)
+    drum_kit = Column(String)
+    pattern_code = Column(Integer)
+    audio_key = Column(String)
+    matcher_choice = Column(String)
+    answered_at = Column(DateTime)
+
+    @classmethod
+    def latest(cls, sync_group_id, node_id):
+        return (
+            cls.query.filter_by(sync_group_id=sync_group_id, node_id=node_id)
+            .order_by(cls.attempt.desc())
+            .first()
+        )
+
+    @classmethod
+    def record(cls, sync_group_id, trial, director_id, matcher_id, stimulus, pattern, audio_key):
+        """Add the director's next attempt at the trial's node; ``pattern`` is a ``Pattern``."""
+        from dallinger import db
+
+        previous = cls.latest(sync_group_id, trial.node_id)
+        attempt = cls(
+            sync_group_id=sync_group_id,
+            node_id=trial.node_id,
+            attempt=previous.attempt + 1 if previous else 1,
+            trial_id=trial.id,
+            director_id=director_id,
+            matcher_id=matcher_id,
+            stimulus=stimulus,
+            grid_size=pattern.grid_size,
+            drum_kit=pattern.kit_type,
+            pattern_code=pattern.code,
+            audio_key=audio_key,
+        )
+        db.session.add(attempt)
+        return attempt
+
+    @classmethod
+    def record_choice(cls, sync_group_id, node_id, matcher_choice):
+        """Store the matcher's choice on the pair's latest attempt at the node."""
+        attempt = cls.latest(sync_group_id, node_id)
+        if attempt is not None:
+            attempt.matcher_choice = matcher_choice
+            attempt.answered_at = datetime.now()
+        return attempt
+
+    @classmethod
+    def export_csv(cls, batch_size=EXPORT_BATCH_SIZE):
+        """Yield the history as CSV text, a row at a time, reading ``batch_size`` rows per query round trip."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def flush():
+            text = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return text
+
+        writer.writerow(EXPORT_COLUMNS)
+        yield flush()
+        for attempt in cls.query.order_by(cls.id).yield_per(batch_size):
+            writer.writerow([getattr(attempt, column) for column in EXPORT_COLUMNS])
+            yield flush()
@@ -0,0 +1,90 @@
+"""
+Director and matcher roles of each sync group, resolved once per barrier epoch.
+
+Finding the director and matcher means loading the group's participants and their vars;
+the trial does it several times per attempt. ``role_registry`` keeps a plain snapshot of
+the two IDs and the vars the trial reads, per group and per process. The snapshot is valid
+until the group's next barrier release: ``NotifyingGroupBarrier`` counts releases in the
+group's ``barrier_epoch`` var, so a lookup costs one read of the group's vars. A change of
+leader (psynet reassigns it when the leader drops out) also re-resolves the roles.
+"""
+import copy
+
+EPOCH_VAR = "barrier_epoch"  # advanced by NotifyingGroupBarrier on every release of the group
+ROLE_VARS = {
+    "director": (),  # the director's rhythms are in rhythm_history.RhythmAttempt
+    "matcher": ("last_action",),
+}
+
+
+class GroupRoles:
+    """Who directs and who matches in one group, and their ``ROLE_VARS``, as of one epoch."""
+
+    def __init__(self, group_id, epoch, director_id, matcher_id, director_vars, matcher_vars):
+        self.group_id = group_id
+        self.epoch = epoch
+        self.director_id = director_id
+        self.matcher_id = matcher_id
+        self.director_vars = director_vars
+        self.matcher_vars = matcher_vars
+
+    @classmethod
+    def resolve(cls, group, epoch):
+        director = group.leader
+        matcher = next((p for p in group.participants if p != director), None)
+        return cls(
+            group_id=group.id,
+            epoch=epoch,
+            director_id=director.id if director else None,
+            matcher_id=matcher.id if matcher else None,
+            director_vars=cls.snapshot(director, ROLE_VARS["director"]),
+            matcher_vars=cls.snapshot(matcher, ROLE_VARS["matcher"]),
+        )
+
+    @staticmethod
+    def snapshot(participant, names):
+        if participant is None:
+            return {}
+        # copied so later in-place edits to the participant's vars can't leak into the record
+        return {name: copy.deepcopy(participant.var.get(name, None)) for name in names}
+
+    def is_director(self, participant):
+        return participant.id == self.director_id
+
+    def is_matcher(self, participant):
+        return participant.id == self.matcher_id
+
+
+class RoleRegistry:
+    def __init__(self):
+        self._records = {}  # group id -> GroupRoles
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, group):
+        """The group's roles, re-resolved if a barrier has released the group since they were cached."""
+        epoch = group.var.get(EPOCH_VAR, 0)
+        record = self._records.get(group.id)
+        if record is not None and record.epoch == epoch and record.director_id == group.leader_id:
+            self.hits += 1
+            return record
+        self.misses += 1
+        record = GroupRoles.resolve(group, epoch)
+        self._records[group.id] = record
+        return record
+
+    def for_participant(self, participant):
+        group = participant.sync_group
+        return self.get(group) if group is not None else None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "groups": len(self._records),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+role_registry = RoleRegistry()
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+pytest.importorskip("psynet")
+
+from .. import barriers  # noqa: E402
+from ..barriers import CACHE_TTL_SECONDS, EVENT_TTL_SECONDS, BarrierIndex  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(barriers.time, "monotonic", clock)
+    monkeypatch.setattr(barriers.barrier_events, "ensure_listener", lambda: None)
+    return clock
+
+
+class Loader:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+def test_events_are_served_from_memory_until_they_expire(clock):
+    index = BarrierIndex()
+    load = Loader(False)
+    index.apply(True, [7])
+    assert index.lookup(7, load) is True
+    assert load.calls == 0
+
+    clock.now += EVENT_TTL_SECONDS + 1
+    assert index.lookup(7, load) is False
+    assert load.calls == 1
+    assert index.stats()["index_hits"] == 1 and index.stats()["db_hits"] == 1
+
+
+def test_database_reads_are_cached_briefly(clock):
+    index = BarrierIndex()
+    load = Loader(True)
+    assert index.lookup("3", load) is True
+    assert index.lookup(3, load) is True
+    assert load.calls == 1
+
+    clock.now += CACHE_TTL_SECONDS + 0.1
+    index.lookup(3, load)
+    assert load.calls == 2
+
+
+def test_event_during_database_read_wins(clock):
+    index = BarrierIndex()
+
+    def stale_load():
+        index.apply(False, [5])  # released while the query ran
+        return True
+
+    assert index.lookup(5, stale_load) is True
+    assert index.lookup(5, Loader(True)) is False
+
+
+def test_events_learned_without_a_listener_expire_quickly(clock):
+    index = BarrierIndex()
+    index.apply(True, [1, 2], ttl=CACHE_TTL_SECONDS)
+    index.apply(True, [3])
+    index.limit_ttl(CACHE_TTL_SECONDS)
+    clock.now += CACHE_TTL_SECONDS + 0.1
+    load = Loader(False)
+    assert [index.lookup(i, load) for i in (1, 2, 3)] == [False, False, False]
+    assert load.calls == 3
+
+
+def test_wait_until_wakes_on_an_event(monkeypatch):
+    monkeypatch.setattr(barriers.barrier_events, "ensure_listener", lambda: None)
+    index = BarrierIndex()
+    index.apply(True, [9])
+    threading.Timer(0.05, index.apply, (False, [9])).start()
+    assert index.wait_until(9, lambda: index.lookup(9, Loader(True)) is False, timeout=5)
+
+
+def test_wait_until_times_out():
+    index = BarrierIndex()
+    assert not index.wait_until(9, lambda: False, timeout=0.05)
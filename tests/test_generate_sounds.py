@@ -0,0 +1,158 @@
+import concurrent.futures
+import os
+import pickle
+
+import pytest
+
+from .. import generate_sounds
+from ..generate_sounds import AudioByteCache, Pattern, RenderBank, RenderService, SampleBank, stimulus_pattern
+
+
+@pytest.mark.parametrize("rhythm", [
+    "hihat_1100_snare_0000_kick_0001",
+    "snare_10101010_kick_00000001",
+    "kick_1000",
+])
+def test_pattern_string_round_trip(rhythm):
+    pattern = Pattern.from_string(rhythm)
+    assert pattern.to_string() == rhythm
+    assert Pattern.from_string(rhythm + "_") == pattern  # the drum machine's trailing underscore
+    assert Pattern.from_code(pattern.code, pattern.grid_size, pattern.kit_type) == pattern
+    assert Pattern.from_kit_pattern(pattern.kit_pattern(), pattern.grid_size, pattern.kit_type) == pattern
+    assert pickle.loads(pickle.dumps(pattern)) == pattern
+
+
+def test_pattern_rows_are_bitmasks_with_step_0_first():
+    pattern = Pattern.from_string("hihat_1000_snare_0100_kick_0001")
+    assert pattern.rows == (0b1000, 0b0100, 0b0001)
+    assert pattern.hit_steps().tolist() == [
+        [True, False, False, False],
+        [False, True, False, False],
+        [False, False, False, True],
+    ]
+
+
+def test_equal_patterns_hash_alike():
+    a = Pattern.from_string("snare_1010_kick_0101")
+    b = Pattern("snare+kick", 4, [0b1010, 0b0101])
+    assert a == b and hash(a) == hash(b)
+    assert a != Pattern.from_string("snare_10100000_kick_01010000")
+
+
+@pytest.mark.parametrize("rhythm", [
+    "",
+    "garbage",
+    "snare_1010",  # not a kit
+    "hihat_1010_kick_0000",  # not a kit
+    "snare_1010_kick",  # drum without steps
+    "snare_1010_kick_010",  # rows of different lengths
+    "snare_10x0_kick_0000",  # not binary
+    "kick_snare_kick_0000",
+])
+def test_malformed_rhythms_are_rejected(rhythm):
+    with pytest.raises(ValueError):
+        Pattern.from_string(rhythm)
+
+
+def test_kit_pattern_must_match_grid_size():
+    with pytest.raises(ValueError):
+        Pattern.from_kit_pattern("10_00", 4, "snare+kick")
+
+
+def test_stimulus_spaces_come_from_the_nodes():
+    pytest.importorskip("psynet")  # node_creation builds psynet StaticNodes
+    assert generate_sounds.stimulus_spaces() == {
+        (grid_size, kit_type) for grid_size in (4, 8) for kit_type in ("snare+kick", "hihat+snare+kick")
+    }
+
+
+@pytest.fixture
+def node_spaces(monkeypatch):
+    spaces = frozenset({(4, "snare+kick"), (8, "hihat+snare+kick")})
+    monkeypatch.setattr(generate_sounds, "stimulus_spaces", lambda: spaces)
+    return spaces
+
+
+@pytest.mark.parametrize("rhythm", ["snare_10101010_kick_00000000", "kick_1000", "snare_" + "1" * 70 + "_kick_" + "0" * 70])
+def test_stimulus_pattern_rejects_spaces_no_node_uses(node_spaces, rhythm):
+    with pytest.raises(ValueError):
+        stimulus_pattern(rhythm)
+
+
+def test_stimulus_pattern_accepts_node_spaces(node_spaces):
+    assert stimulus_pattern("hihat_10001000_snare_00000000_kick_10000000").grid_size == 8
+
+
+def test_render_bank_reads_what_was_put(tmp_path):
+    writer = RenderBank(4, "snare+kick", bank_dir=str(tmp_path))
+    patterns = [Pattern.from_code(code, 4, "snare+kick") for code in (0, 7, 255)]
+    for pattern in patterns:
+        writer.put(pattern, f"render {pattern.code}".encode())
+
+    # another process only knows the bank from its files
+    reader = RenderBank(4, "snare+kick", bank_dir=str(tmp_path))
+    for pattern in patterns:
+        assert pattern in reader
+        assert reader.get(pattern) == f"render {pattern.code}".encode()
+    assert reader.get(Pattern.from_code(8, 4, "snare+kick")) is None
+
+
+def test_render_bank_rejects_renders_that_do_not_match_their_hash(tmp_path):
+    writer = RenderBank(4, "snare+kick", bank_dir=str(tmp_path))
+    good, bad = Pattern.from_code(1, 4, "snare+kick"), Pattern.from_code(2, 4, "snare+kick")
+    writer.put(good, b"render 1")
+    writer.put(bad, b"render 2")
+    with open(writer.data_path, 'r+b') as f:
+        f.seek(len(b"render 1"))
+        f.write(b"R")
+
+    reader = RenderBank(4, "snare+kick", bank_dir=str(tmp_path))
+    assert reader.verify() == [bad.code]
+    assert reader.get(good) == b"render 1"
+    assert reader.get(bad) is None
+
+
+@pytest.fixture
+def strict_umask():
+    previous = os.umask(0o077)
+    yield
+    os.umask(previous)
+
+
+def test_banks_are_readable_by_other_users(tmp_path, strict_umask):
+    bank = RenderBank(4, "snare+kick", bank_dir=str(tmp_path))
+    bank.put(Pattern.from_code(1, 4, "snare+kick"), b"render")
+    samples = SampleBank(cache_dir=str(tmp_path)).preload()
+    for path in (bank.data_path, bank.index_path, samples.cache_path):
+        assert os.stat(path).st_mode & 0o777 == 0o644
+
+
+def test_audio_byte_cache_evicts_least_recently_used():
+    cache = AudioByteCache(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"  # now b is the least recently used
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa" and cache.get("c") == b"cccc"
+    assert cache.stats()["bytes"] == 8
+
+
+class BrokenPool:
+    def submit(self, *args):
+        raise concurrent.futures.BrokenExecutor("a render worker died")
+
+    def shutdown(self, **kwargs):
+        pass
+
+
+def test_render_service_replaces_a_broken_pool(monkeypatch, tmp_path, node_spaces):
+    # the forked workers decode the drums into this table instead of static/render_bank
+    monkeypatch.setattr(generate_sounds, "sample_bank", SampleBank(cache_dir=str(tmp_path)))
+    service = RenderService(max_workers=1)
+    service._executor, service._executor_pid = BrokenPool(), os.getpid()
+    try:
+        data, _ = service.submit("snare_1000_kick_0010").result(timeout=60)
+    finally:
+        service.shutdown()
+    assert data
@@ -0,0 +1,74 @@
+import pytest
+
+pytest.importorskip("psynet")
+
+from ..vars_update import VarsUpdate  # noqa: E402
+
+
+class Owner:
+    """Stands in for a participant: ``vars`` is only replaced, never edited in place."""
+
+    def __init__(self, id, vars=None):
+        self.id = id
+        self.vars = vars
+        self.assignments = 0
+
+    def __setattr__(self, name, value):
+        if name == "vars" and "vars" in self.__dict__:
+            self.__dict__["assignments"] += 1
+        super().__setattr__(name, value)
+
+
+def test_changes_are_merged_into_one_assignment_per_owner():
+    director = Owner(1, {"last_action": "kick_1000", "score": 2})
+    matcher = Owner(2)
+    with VarsUpdate("test", measure_every=1) as update:
+        update.set(director, "score", 3)
+        update.set(director, "note", "x")
+        update.set(matcher, "director_answer", "kick_1000")
+        update.set(matcher, "audio_url", "/rhythm_audio/kick_1000")
+        assert director.assignments == 0
+
+    assert director.vars == {"last_action": "kick_1000", "score": 3, "note": "x"}
+    assert matcher.vars == {"director_answer": "kick_1000", "audio_url": "/rhythm_audio/kick_1000"}
+    assert director.assignments == 1 and matcher.assignments == 1
+    assert set(update.bytes_written) == {("Owner", 1), ("Owner", 2)}
+
+
+def test_only_sampled_updates_are_measured():
+    owner = Owner(1)
+    measured = 0
+    for _ in range(10):
+        with VarsUpdate("test", measure_every=5) as update:
+            update.set(owner, "a", 1)
+        measured += bool(update.bytes_written)
+    assert measured == 2
+
+
+def test_get_sees_pending_changes():
+    owner = Owner(1, {"a": 1})
+    with VarsUpdate("test") as update:
+        assert update.get(owner, "a") == 1
+        update.set(owner, "a", 2)
+        assert update.get(owner, "a") == 2
+        assert update.get(owner, "missing", "default") == "default"
+
+
+def test_set_item_replaces_the_nested_dict():
+    nested = {"red": "old"}
+    owner = Owner(1, {"urls": nested})
+    with VarsUpdate("test") as update:
+        update.set_item(owner, "urls", "blue", "new")
+        update.set_item(owner, "urls", "red", "newer")
+    assert owner.vars["urls"] == {"red": "newer", "blue": "new"}
+    assert nested == {"red": "old"}  # never edited in place, so the change is always written
+
+
+def test_nothing_is_written_after_an_exception():
+    owner = Owner(1, {"a": 1})
+    with pytest.raises(RuntimeError):
+        with VarsUpdate("test") as update:
+            update.set(owner, "a", 2)
+            raise RuntimeError
+    assert owner.vars == {"a": 1} and owner.assignments == 0
+    assert update.bytes_written == {}
@@ -0,0 +1,74 @@
+"""
+Batched writes to participant vars.
+
+``vars`` is a single serialized column that only notices top-level assignments, so nested
+edits such as ``participant.vars["node_rhythms"][color] = rhythm`` can be lost, and each
+top-level assignment marks the whole blob dirty again. ``VarsUpdate`` collects the changes
+made in a block, then gives each participant one fresh ``vars`` dict, and reports the
+serialized size written for a sample of the blocks.
+"""
+import itertools
+
+from psynet.utils import get_logger
+
+logger = get_logger()
+
+# measuring re-serializes the vars, so by default only every 20th update in a process does
+MEASURE_EVERY = 20
+
+
+class VarsUpdate:
+    """
+    Context manager collecting var changes for several owners (participants, trials, ...).
+
+    Reads through ``get`` see the pending changes. On a clean exit every owner with changes
+    gets its vars assigned once; after an exception nothing is written. For every
+    ``measure_every``-th update, ``bytes_written`` maps ``(owner class name, owner ID)`` to
+    the serialized size of the vars written for that owner; otherwise it stays empty.
+    """
+
+    _updates = itertools.count()
+
+    def __init__(self, label, measure_every=MEASURE_EVERY):
+        self.label = label
+        self.measure = next(self._updates) % measure_every == 0
+        self.bytes_written = {}
+        self._pending = {}  # id(owner) -> (owner, {name: value})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._pending = {}
+
+    def get(self, owner, name, default=None):
+        pending = self._pending.get(id(owner))
+        if pending is not None and name in pending[1]:
+            return pending[1][name]
+        return (owner.vars or {}).get(name, default)
+
+    def set(self, owner, name, value):
+        self._pending.setdefault(id(owner), (owner, {}))[1][name] = value
+
+    def set_item(self, owner, name, key, value):
+        """Set ``owner.vars[name][key]``, replacing the nested dict so the change is written."""
+        self.set(owner, name, {**(self.get(owner, name) or {}), key: value})
+
+    def commit(self):
+        from psynet.serialize import serialize
+
+        for owner, changes in self._pending.values():
+            new_vars = {**(owner.vars or {}), **changes}
+            owner.vars = new_vars
+            if self.measure:
+                self.bytes_written[type(owner).__name__, owner.id] = len(serialize(new_vars).encode())
+        self._pending = {}
+        if self.bytes_written:
+            logger.info(
+                "%s: wrote %d bytes of vars for %d owners %s",
+                self.label, sum(self.bytes_written.values()), len(self.bytes_written), self.bytes_written,
+            )
+        return sum(self.bytes_written.values())
@@ -1,8 +1,63 @@
 from psynet.page import InfoPage
 from markupsafe import Markup
 
+# Long-polls /participant_in_barrier/<id>/wait, which answers as soon as the participant
+# is out of their barrier (or after ~20 s, when we ask again). The page also submits itself
+# after max_page_seconds so the barrier's while_loop can enforce its max_wait_time.
+LONG_POLL_SCRIPT = """
+<script>
+(function () {
+    var started = Date.now();
+    var maxPageMs = %(max_page_ms)d;
+
+    function waitForRelease() {
+        if (Date.now() - started > maxPageMs) {
+            psynet.nextPage();
+            return;
+        }
+        let route = "/participant_in_barrier/" + psynet.participantId + "/wait";
+        dallinger.get(route, {in_barrier: true}).then(
+            (resp) => {
+                if (resp.in_barrier) {
+                    waitForRelease();
+                } else {
+                    psynet.nextPage();
+                }
+            },
+            () => setTimeout(waitForRelease, 1000)
+        );
+    }
+
+    function start() {
+        if (!psynet.pageLoaded) {
+            setTimeout(start, 50);
+            return;
+        }
+        waitForRelease();
+    }
+
+    start();
+})();
+</script>
+"""
+
+
+def long_poll_script(max_page_seconds=30):
+    return LONG_POLL_SCRIPT % {"max_page_ms": max_page_seconds * 1000}
+
+
+def barrier_wait_page(content="Waiting for your partner...", max_page_seconds=30):
+    """Waiting page that advances as soon as the participant's barrier releases, without a fixed floor"""
+    return InfoPage(
+        content,
+        time_estimate=5,
+        show_next_button=False,
+        scripts=[long_poll_script(max_page_seconds)],
+    )
+
+
 def video_wait_page():
-    """InfoPage with embedded YouTube video and custom barrier polling"""
+    """InfoPage with embedded YouTube video and long-polling for the barrier release"""
     return InfoPage(
         Markup("""
         <div style='text-align: center; margin: 20px;'>
@@ -22,30 +77,5 @@ def video_wait_page():
         """),
         time_estimate=30,
         show_next_button=False,
-        scripts=[
-            """
-            <script>
-            function checkCanLeave() {
-                if (!psynet.pageLoaded) {
-                    return;
-                }
-                canLeave().then((canLeaveResult) => {
-                    if (canLeaveResult) {
-                        psynet.nextPage();
-                    }
-                });
-            }
-
-            function canLeave() {
-                let route = "/participant_in_barrier/" + psynet.participantId;
-                return dallinger.get(route).then((resp) => {
-                    let participant_in_barrier = resp.result;
-                    return !participant_in_barrier;
-                });
-            }
-
-            setInterval(checkCanLeave, 1000);
-            </script>
-            """
-        ]
-    )
\ No newline at end of file
+        scripts=[long_poll_script()],
+    )